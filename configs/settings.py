@@ -1,10 +1,10 @@
 from typing import List, Optional, Union
 
-from pydantic import field_validator, BaseModel
+from pydantic import field_validator, PrivateAttr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from models.config_schemas import AppConfig
-from utils.parse import parse_config_to_model
+from utils.parse import ConfigCache
 
 
 class Settings(BaseSettings):
@@ -38,6 +38,8 @@ class Settings(BaseSettings):
     mp_model_name: str
     fs_model_name: str
     wechat_mp_secret: Optional[str]
+    wechat_mp_app_id: Optional[str] = None  # 配置后超时未生成的回答改用客服消息发送
+    wechat_mp_app_secret: Optional[str] = None
     dify_mp_secret: Optional[str]
     dify_fs_secret: Optional[str]
 
@@ -51,6 +53,10 @@ class Settings(BaseSettings):
     # 数据库
     database_url: str = "sqlite:///./app.db"
 
+    # 配置文件变更检查间隔（秒）
+    config_check_interval: float = 1.0
+    _config_cache: Optional[ConfigCache] = PrivateAttr(default=None)
+
     @field_validator("cors_origins", mode="before")
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> List[str]:
         """统一将字符串或列表转换为 List[str]"""
@@ -61,11 +67,16 @@ class Settings(BaseSettings):
             return v
         raise ValueError(f"Invalid CORS_ORIGINS format: {v}")
 
-    # 延迟加载的配置
+    # 延迟加载的配置，解析结果缓存为只读快照，文件变更后热加载
+    @property
+    def config_cache(self) -> ConfigCache:
+        if self._config_cache is None:
+            self._config_cache = ConfigCache(AppConfig, self.config_file, self.config_check_interval)
+        return self._config_cache
+
     @property
-    def config(self) -> BaseModel:
-        app_config = parse_config_to_model(AppConfig, self.config_file)
-        return app_config
+    def config(self) -> AppConfig:
+        return self.config_cache.get()
 
 
 settings = Settings()
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from models.exception_model import CircuitOpenException, ConcurrencyLimitException
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class AdaptiveLimiter:
+    """AIMD自适应并发上限：首包时延在阈值内的成功请求使上限加性增长（每轮约+1），
+    失败或时延超阈值时乘性下降（每个冷却期最多一次）；超出上限的请求排队，排队超时则拒绝"""
+
+    def __init__(self, initial=10, min_limit=1, max_limit=50, latency_threshold=3.0, backoff=0.75, cooldown=1.0, max_wait=10.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self.stats = {"admitted": 0, "rejected": 0, "increases": 0, "decreases": 0}
+        self._inflight = 0
+        self._waiters = deque()
+        self._decreased_at = 0.0
+        self._listeners = []
+
+    @property
+    def metrics(self):
+        return {**self.stats, "limit": round(self.limit, 2), "inflight": self._inflight, "waiting": len(self._waiters)}
+
+    def subscribe(self, callback):
+        """并发上限（取整后）变化时调用callback(limit)，用于让上游的调度容量跟随"""
+        self._listeners.append(callback)
+
+    def reconfigure(self, min_limit, max_limit, latency_threshold, max_wait, limit=None):
+        """limit不为None时从该值重新开始自适应，否则保留当前上限并限制在新的范围内"""
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.max_wait = max_wait
+        self._set_limit(min(max(self.limit if limit is None else limit, min_limit), max_limit))
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self):
+        """获得一个并发名额，退出时归还"""
+        if self._inflight < int(self.limit) and not self._waiters:
+            self._inflight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait_for(future, self.max_wait)
+            except BaseException as exc:
+                if future.done() and not future.cancelled():
+                    self._release()  # 名额已分配但调用方已放弃
+                elif future in self._waiters:
+                    self._waiters.remove(future)
+                if isinstance(exc, asyncio.TimeoutError):
+                    self.stats["rejected"] += 1
+                    logger.warning(f"LLM并发已达自适应上限，排队超时: {self.metrics}")
+                    raise ConcurrencyLimitException(f"LLM并发已达上限{int(self.limit)}") from exc
+                raise
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def record(self, succeeded, latency):
+        if succeeded and latency <= self.latency_threshold:
+            if self.limit < self.max_limit:
+                self._set_limit(min(self.max_limit, self.limit + 1 / self.limit))
+                self.stats["increases"] += 1
+                self._dispatch()
+            return
+        now = time.monotonic()
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        limit = max(self.min_limit, self.limit * self.backoff)
+        if limit < self.limit:
+            self.stats["decreases"] += 1
+            logger.warning(f"LLM后端{'失败' if not succeeded else f'响应变慢({latency:.2f}秒)'}，并发上限从{self.limit:.1f}降到{limit:.1f}")
+            self._set_limit(limit)
+
+    def _set_limit(self, limit):
+        changed = int(limit) != int(self.limit)
+        self.limit = float(limit)
+        if changed:
+            for callback in self._listeners:
+                callback(int(limit))
+
+    def _release(self):
+        self._inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self._inflight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self._inflight += 1
+                future.set_result(None)
+
+
+class CircuitBreaker:
+    """熔断器：滑动窗口内请求数达到min_requests且错误率超过阈值时打开，打开期间直接拒绝；
+    到期后半开放行一个试探请求，成功则关闭，失败则重新打开"""
+
+    def __init__(self, error_threshold=0.5, min_requests=20, window=30, open_seconds=30.0):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.window = window  # 秒，按秒分桶统计
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.stats = {"opened": 0, "short_circuited": 0}
+        self._buckets = deque()  # [秒, 请求数, 失败数]
+        self._opened_until = 0.0
+        self._trial = False
+
+    @property
+    def metrics(self):
+        requests, failures = self._counts()
+        return {**self.stats, "state": self.state, "requests": requests, "failures": failures,
+                "error_rate": round(failures / requests, 4) if requests else 0.0}
+
+    def reconfigure(self, error_threshold, min_requests, window, open_seconds):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+
+    def before_request(self):
+        """熔断打开时抛出CircuitOpenException；半开时只放行一个试探请求，返回是否为试探请求"""
+        if self.state == "open":
+            if time.monotonic() < self._opened_until:
+                self._short_circuit()
+            self.state = "half_open"
+            logger.info("LLM熔断器半开，放行试探请求")
+        if self.state == "half_open":
+            if self._trial:
+                self._short_circuit()
+            self._trial = True
+            return True
+        return False
+
+    def record(self, succeeded, trial=False):
+        """succeeded为None表示请求被取消或未发出，不计入统计"""
+        if trial:
+            self._trial = False
+            if succeeded is None:
+                return
+            if succeeded:
+                self.state = "closed"
+                self._buckets.clear()
+                logger.info("LLM熔断器已关闭")
+            else:
+                self._open()
+            return
+        if succeeded is None:
+            return
+        second = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == second:
+            bucket = self._buckets[-1]
+        else:
+            bucket = [second, 0, 0]
+            self._buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += not succeeded
+        if self.state != "closed" or succeeded:
+            return
+        requests, failures = self._counts()
+        if requests >= self.min_requests and failures / requests >= self.error_threshold:
+            self._open()
+
+    def _counts(self):
+        horizon = int(time.monotonic()) - self.window
+        while self._buckets and self._buckets[0][0] <= horizon:
+            self._buckets.popleft()
+        return sum(bucket[1] for bucket in self._buckets), sum(bucket[2] for bucket in self._buckets)
+
+    def _open(self):
+        self.state = "open"
+        self._opened_until = time.monotonic() + self.open_seconds
+        self.stats["opened"] += 1
+        logger.error(f"LLM后端错误率过高，熔断{self.open_seconds}秒: {self.metrics}")
+
+    def _short_circuit(self):
+        self.stats["short_circuited"] += 1
+        raise CircuitOpenException(f"LLM熔断中: {self.state}")
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class AdmissionQueue:
+    """入站事件准入队列：有界排队 + 固定数量worker消费，队列满时快速拒绝（削峰），并持有所有后台任务引用"""
+
+    def __init__(self, queue_size=100, worker_count=10):
+        self.queue_size = queue_size
+        self.worker_count = worker_count
+        self.stats = {"submitted": 0, "rejected": 0, "started": 0, "completed": 0, "failed": 0, "running": 0,
+                      "wait_total": 0.0, "wait_max": 0.0}
+        self._queue = None
+        self._workers = []
+        self._tasks = set()  # 持有后台任务引用，避免被垃圾回收或异常被静默丢弃
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def metrics(self):
+        started = self.stats["started"]
+        wait_avg = self.stats["wait_total"] / started if started else 0.0
+        return {**self.stats, "depth": self.depth, "wait_avg": round(wait_avg, 4), "background_tasks": len(self._tasks)}
+
+    def start(self, loop):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [loop.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"准入队列已启动: queue_size={self.queue_size}, workers={self.worker_count}")
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._tasks, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, name, func, *args) -> bool:
+        """提交任务（协程函数及参数），队列满时返回False，由调用方负责降级处理"""
+        try:
+            self._queue.put_nowait((name, time.monotonic(), func, args))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            logger.warning(f"准入队列已满，拒绝任务: {name}, 队列指标: {self.metrics}")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def spawn(self, coro, name=None):
+        """启动不经过排队的轻量后台任务，并记录其异常"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._on_task_done(name or coro.__qualname__, t))
+        return task
+
+    def _on_task_done(self, name, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"后台任务异常: {name}, err: {task.exception()}")
+
+    async def _worker(self, index):
+        while True:
+            name, enqueued_at, func, args = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self.stats["started"] += 1
+            self.stats["wait_total"] += wait
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+            self.stats["running"] += 1
+            try:
+                await func(*args)
+                self.stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.stats["failed"] += 1
+                logger.error(f"准入队列任务异常: {name}, worker={index}, err: {err}")
+            finally:
+                self.stats["running"] -= 1
+                self._queue.task_done()
+            logger.debug(f"任务完成: {name}, 排队{wait:.3f}秒, 队列指标: {self.metrics}")
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import deque
+
+from utils.logger import get_logger
+from utils.metrics import Histogram
+
+logger = get_logger()
+
+# 飞书在开启流式更新约10分钟后自动关闭卡片的streaming_mode，之后的流式文本更新会失败；
+# 预创建卡片的最长保留时间需为生成回答留出余量
+MAX_CARD_AGE = 480
+
+
+class CardPool:
+    """预创建流式卡片池：后台按水位补充卡片，处理消息时只需发送卡片，省去一次创建卡片的OpenAPI调用"""
+
+    def __init__(self, feishu_client, size=10, max_age=MAX_CARD_AGE, refill_interval=5.0):
+        if not 0 < max_age <= MAX_CARD_AGE:
+            raise ValueError(f"max_age must be in (0, {MAX_CARD_AGE}]: {max_age}")
+        self.feishu_client = feishu_client
+        self.size = size  # 目标水位
+        self.max_age = max_age  # 超过该时长的预创建卡片流式模式即将关闭，直接丢弃
+        self.refill_interval = refill_interval
+        self.create_latency = Histogram("feishu_card_create_seconds")
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "created": 0, "failed": 0}
+        self._cards = deque()  # (card_id, created_at)，先进先出
+        self._refill = None
+        self._task = None
+
+    @property
+    def metrics(self):
+        requests = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / requests if requests else 0.0
+        # 每次命中省去一次创建卡片的调用，按平均创建耗时估算节省的延迟
+        mean_latency = self.create_latency.sum / self.create_latency.count if self.create_latency.count else 0.0
+        return {**self.stats, "available": len(self._cards), "hit_rate": round(hit_rate, 4),
+                "latency_saved": round(self.stats["hits"] * mean_latency, 4), "create_latency": self.create_latency.snapshot()}
+
+    def start(self, loop):
+        self._refill = asyncio.Event()
+        self._task = loop.create_task(self._refill_loop())
+        logger.info(f"卡片池已启动: size={self.size}, max_age={self.max_age}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def acquire(self):
+        """取一张可用的预创建卡片，池为空时退化为现场创建"""
+        self._drop_expired()
+        if self._cards:
+            card_id, _ = self._cards.popleft()
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            card_id = await self._create()
+        if self._refill is not None:
+            self._refill.set()  # 唤醒后台补充
+        return card_id
+
+    def _drop_expired(self):
+        deadline = time.monotonic() - self.max_age
+        while self._cards and self._cards[0][1] < deadline:
+            card_id, _ = self._cards.popleft()
+            self.stats["expired"] += 1
+            logger.debug(f"丢弃过期的预创建卡片: card_id={card_id}")
+
+    async def _create(self):
+        started = time.perf_counter()
+        try:
+            card_id = await self.feishu_client.create_card()
+        except Exception as err:
+            logger.error(f"创建卡片异常: {err}")
+            card_id = None
+        self.create_latency.observe(time.perf_counter() - started)
+        if card_id:
+            self.stats["created"] += 1
+        else:
+            self.stats["failed"] += 1
+        return card_id
+
+    async def _fill(self):
+        self._drop_expired()
+        missing = self.size - len(self._cards)
+        if missing <= 0:
+            return
+        card_ids = await asyncio.gather(*(self._create() for _ in range(missing)))
+        now = time.monotonic()
+        self._cards.extend((card_id, now) for card_id in card_ids if card_id)
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await self._fill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"补充卡片池异常: {err}")
+            try:
+                await asyncio.wait_for(self._refill.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill.clear()
+            logger.opt(lazy=True).debug("卡片池指标: {}", lambda: self.metrics)
@@ -0,0 +1,113 @@
+import asyncio
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class CardStreamer:
+    """流式卡片更新管道：独立读取LLM流、合并增量，按时间/字数窗口批量刷新卡片。
+    card_id可以稍后通过bind_card绑定，在此之前收到的增量会先缓存，卡片就绪后一并刷新"""
+
+    def __init__(self, feishu_client, card_id=None, sequence=1, flush_interval_ms=150, flush_chars=200):
+        self.feishu_client = feishu_client
+        self.card_id = card_id
+        self.sequence = sequence  # 下一次更新使用的sequence，必须严格递增
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_chars = flush_chars
+        self.answer = ''
+        self.answer_bytes = 0  # 已累积回答的UTF-8字节数，随增量累加
+        self.failed = False
+        self._flushed_answer = ''
+        self._finished = False
+        self._dirty = asyncio.Event()
+        self._card_ready = asyncio.Event()
+        if card_id:
+            self._card_ready.set()
+        self.stats = {"chunks": 0, "flushes": 0, "bytes_sent": 0, "bytes_naive": 0}
+
+    @property
+    def bytes_saved(self):
+        return self.stats["bytes_naive"] - self.stats["bytes_sent"]
+
+    def bind_card(self, card_id):
+        """卡片已发送，开始刷新已缓存的内容"""
+        self.card_id = card_id
+        self._card_ready.set()
+
+    def abort(self):
+        """卡片准备失败，放弃刷新"""
+        self.failed = True
+        self._card_ready.set()
+
+    def feed(self, content):
+        """追加一个增量，积累到字数窗口时提前唤醒刷新"""
+        self.answer += content
+        self.answer_bytes += len(content.encode('utf-8'))
+        self.stats["chunks"] += 1
+        self.stats["bytes_naive"] += self.answer_bytes  # 逐块更新时本应发送的字节数
+        if len(self.answer) - len(self._flushed_answer) >= self.flush_chars:
+            self._dirty.set()
+
+    async def run(self, generator):
+        """消费生成器直至结束，保证最终状态一定被刷新，返回完整回答"""
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            async for content in generator:
+                if flusher.done():  # 刷新已失败，停止读取
+                    break
+                if content:
+                    self.feed(content)
+        finally:
+            self._finished = True
+            self._dirty.set()
+            await flusher
+        logger.info(f"卡片流式更新完成: card_id={self.card_id}, chunks={self.stats['chunks']}, flushes={self.stats['flushes']}, "
+                    f"bytes_sent={self.stats['bytes_sent']}, bytes_saved={self.bytes_saved}")
+        return self.answer
+
+    async def finish(self, suffix):
+        """追加结束语（如排队超时、已中断）并立即刷新卡片"""
+        self.feed(suffix)
+        return await self.run(_empty_stream())
+
+    async def _flush_loop(self):
+        await self._card_ready.wait()
+        if self.card_id is None:
+            self.failed = True
+            return
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            finished = self._finished  # 先记录结束标志，保证其后的刷新包含最终内容
+            if self.answer != self._flushed_answer and not await self._flush():
+                self.failed = True
+                return
+            if finished:
+                return
+
+    async def _flush(self):
+        """刷新卡片，成功后sequence递增；限流和重试由飞书传输层统一处理"""
+        answer = self.answer
+        try:
+            response = await self.feishu_client.update_card(self.card_id, answer, self.sequence)
+        except Exception as err:
+            logger.error(f"更新卡片失败: {str(err)}")
+            return False
+        if self.sequence <= 1:
+            logger.info(f"卡片更新成功！sequence={self.sequence}. ---\n... ...\n---")
+        logger.opt(lazy=True).debug("卡片更新成功！sequence={}. \n飞书响应: code={}, msg={}, data={}, log_id={}", lambda: self.sequence,
+                                    lambda: response.code, lambda: response.msg, lambda: getattr(response, 'data', None), response.get_log_id)
+        self.sequence += 1
+        self.stats["flushes"] += 1
+        self.stats["bytes_sent"] += len(answer.encode('utf-8'))
+        self._flushed_answer = answer
+        return True
+
+
+async def _empty_stream():
+    return
+    yield
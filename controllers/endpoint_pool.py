@@ -0,0 +1,185 @@
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import httpx
+
+from utils.logger import get_logger
+from utils.metrics import Histogram
+
+logger = get_logger()
+
+
+class Endpoint:
+    """一个后端副本：独立的连接池，以及在途数、首包时延EWMA、错误数和剔除状态"""
+
+    def __init__(self, base_url, weight, headers, client):
+        self.base_url = base_url
+        self.weight = weight
+        self.headers = headers
+        self.client = client
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.ewma = 0.0  # 首包时延的指数加权平均（秒）
+        self.latency = Histogram(f"llm_endpoint_latency_seconds:{base_url}")
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self):
+        if not self.ejections:
+            return "healthy"
+        return "ejected" if time.monotonic() < self.ejected_until else "probing"
+
+    @property
+    def metrics(self):
+        return {"base_url": self.base_url, "weight": self.weight, "state": self.state, "inflight": self.inflight,
+                "requests": self.requests, "errors": self.errors,
+                "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+                "ewma_ms": round(self.ewma * 1000, 1), "latency": self.latency.snapshot()}
+
+
+class Lease:
+    def __init__(self, endpoint, probe):
+        self.endpoint = endpoint
+        self.probe = probe
+        self.failed = False
+        self.succeeded = None  # 请求结束后的结果，被取消时为None
+        self.latency = 0.0  # 首包时延
+
+    def fail(self):
+        """后端返回5xx或429等表示自身不可用的状态码"""
+        self.failed = True
+
+
+class EndpointPool:
+    """多副本负载均衡：按最少在途请求（或EWMA首包时延）加权选择后端；连续失败的后端被剔除一段时间，
+    到期后放行单个探测请求，成功则恢复；Dify会话按conversation_id固定在创建它的后端"""
+    strategies = ("least_outstanding", "ewma")
+
+    def __init__(self, endpoints, headers, concurrency_limit, timeout, strategy="least_outstanding", eject_failures=3,
+                 eject_seconds=30.0, affinity_max_size=10000, ewma_alpha=0.3):
+        if strategy not in self.strategies:
+            raise ValueError(f"Unsupported lb_strategy: {strategy}")
+        self.strategy = strategy
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.affinity_max_size = affinity_max_size
+        self.ewma_alpha = ewma_alpha
+        self.endpoints = []
+        for base_url, weight, api_key in endpoints:
+            endpoint_headers = {**headers, "Authorization": f"Bearer {api_key}"} if api_key else headers
+            # 配置连接池参数（等效于原TCPConnector）
+            client = httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=concurrency_limit),
+                                       timeout=httpx.Timeout(timeout), http2=True, follow_redirects=True)
+            self.endpoints.append(Endpoint(base_url, weight, endpoint_headers, client))
+        self._by_url = {endpoint.base_url: endpoint for endpoint in self.endpoints}
+        self._affinity = OrderedDict()  # conversation_id -> Endpoint
+
+    @property
+    def metrics(self):
+        return [endpoint.metrics for endpoint in self.endpoints]
+
+    def get(self, base_url):
+        return self._by_url.get(base_url)
+
+    def set_timeout(self, timeout):
+        for endpoint in self.endpoints:
+            endpoint.client.timeout = httpx.Timeout(timeout)
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()  # 显式关闭连接池
+
+    def bind(self, affinity_key, endpoint):
+        """把会话固定到创建它的后端，超出容量时淘汰最久未使用的会话"""
+        if not affinity_key or len(self.endpoints) == 1:
+            return
+        self._affinity[affinity_key] = endpoint
+        self._affinity.move_to_end(affinity_key)
+        while len(self._affinity) > self.affinity_max_size:
+            self._affinity.popitem(last=False)
+
+    def pick(self, affinity_key=None, exclude=()):
+        """选择后端：会话所在后端未被剔除时优先（不受exclude影响）；其余按负载打分，剔除期满的后端承担一个探测请求"""
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        endpoint = self._affinity.get(affinity_key) if affinity_key else None
+        if endpoint is not None:
+            self._affinity.move_to_end(affinity_key)
+            if endpoint.state != "ejected":
+                return endpoint
+            logger.warning(f"会话所在的后端已被剔除，改由其他后端处理: conversation_id={affinity_key}, endpoint={endpoint.base_url}")
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+        for endpoint in candidates:
+            if endpoint.state == "probing" and not endpoint.probing:
+                return endpoint
+        healthy = [endpoint for endpoint in candidates if endpoint.state == "healthy"]
+        if not healthy:
+            # 全部不可用时仍然尝试最早到期的后端，而不是直接拒绝
+            return min(candidates, key=lambda endpoint: endpoint.ejected_until)
+        return min(healthy, key=self._score)
+
+    def _score(self, endpoint):
+        load = (endpoint.inflight + 1) / endpoint.weight
+        if self.strategy == "ewma":
+            load *= endpoint.ewma or 0.001
+        return load, random.random()  # 分数相同时随机选择，避免总落在第一个后端
+
+    @asynccontextmanager
+    async def lease(self, affinity_key=None, endpoint=None, exclude=()):
+        """占用一个后端完成一次请求，并根据结果更新其健康状态；被取消的请求不计入成功或失败"""
+        endpoint = endpoint or self.pick(affinity_key, exclude)
+        probe = endpoint.state == "probing" and not endpoint.probing
+        if probe:
+            endpoint.probing = True
+            logger.info(f"向已剔除的后端发送探测请求: {endpoint.base_url}")
+        lease = Lease(endpoint, probe)
+        endpoint.inflight += 1
+        endpoint.requests += 1
+        try:
+            yield lease
+            lease.succeeded = True
+        except httpx.TransportError:
+            lease.succeeded = False
+            raise
+        except Exception:
+            lease.succeeded = True  # 解析错误等与后端可用性无关
+            raise
+        finally:
+            endpoint.inflight -= 1
+            if probe:
+                endpoint.probing = False
+            if lease.failed:
+                lease.succeeded = False
+            if lease.succeeded is False:
+                self._on_failure(endpoint, probe)
+            elif lease.succeeded:
+                self._on_success(endpoint)
+
+    def observe(self, lease, latency):
+        endpoint = lease.endpoint
+        lease.latency = latency
+        endpoint.latency.observe(latency)
+        endpoint.ewma = latency if not endpoint.ewma else endpoint.ewma + self.ewma_alpha * (latency - endpoint.ewma)
+
+    def _on_success(self, endpoint):
+        if endpoint.ejections:
+            logger.info(f"后端已恢复: {endpoint.base_url}")
+        endpoint.consecutive_failures = 0
+        endpoint.ejections = 0
+
+    def _on_failure(self, endpoint, probe=False):
+        endpoint.errors += 1
+        endpoint.consecutive_failures += 1
+        if (probe or endpoint.consecutive_failures >= self.eject_failures) and len(self.endpoints) > 1:
+            # 连续被剔除时逐次延长剔除时长
+            duration = self.eject_seconds * 2 ** min(endpoint.ejections, 5)
+            endpoint.ejections += 1
+            endpoint.ejected_until = time.monotonic() + duration
+            endpoint.consecutive_failures = 0
+            logger.warning(f"后端连续失败，剔除{duration:g}秒: {endpoint.base_url}, 指标: {endpoint.metrics}")
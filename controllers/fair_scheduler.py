@@ -0,0 +1,151 @@
+import asyncio
+from collections import deque, defaultdict
+from contextlib import asynccontextmanager
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class _Flow:
+    __slots__ = ("key", "weight", "deficit", "waiters")
+
+    def __init__(self, key, weight):
+        self.key = key
+        self.weight = weight
+        self.deficit = 0.0
+        self.waiters = deque()  # (user_key, future)
+
+
+class FairScheduler:
+    """LLM调用的加权公平调度（Deficit Round Robin）：按流（单聊用户/群聊）轮转分配并发名额，并限制单个用户的在途请求数"""
+
+    def __init__(self, capacity=10, user_inflight_limit=2, quantum=1.0, max_wait=60):
+        if quantum <= 0:
+            raise ValueError(f"quantum must be positive: {quantum}")
+        self.capacity = capacity  # 同时发往LLM的请求数
+        self.user_inflight_limit = user_inflight_limit
+        self.quantum = quantum
+        self.max_wait = max_wait  # 排队超过该时长放弃，由调用方降级
+        self.stats = {"granted": 0, "timeouts": 0}
+        self._flows = {}  # flow_key -> _Flow
+        self._active = deque()  # 有等待者的流，轮转顺序
+        self._user_inflight = defaultdict(int)
+        self._inflight = 0
+
+    def reconfigure(self, capacity, user_inflight_limit, quantum, max_wait):
+        """在线调整调度参数，扩容时立即放行等待者"""
+        if quantum <= 0:
+            raise ValueError(f"quantum must be positive: {quantum}")
+        self.capacity = capacity
+        self.user_inflight_limit = user_inflight_limit
+        self.quantum = quantum
+        self.max_wait = max_wait
+        self._dispatch()
+
+    def set_capacity(self, capacity):
+        """跟随LLM客户端的自适应并发上限调整容量，超出的请求留在公平调度中排队"""
+        self.capacity = capacity
+        self._dispatch()
+
+    @property
+    def metrics(self):
+        return {**self.stats, "inflight": self._inflight, "active_flows": len(self._active),
+                "waiting": sum(len(flow.waiters) for flow in self._active)}
+
+    @asynccontextmanager
+    async def slot(self, flow_key, user_key, weight=1.0):
+        """等待调度获得一个LLM并发名额，退出时归还"""
+        if weight <= 0:
+            raise ValueError(f"weight must be positive: {weight}")  # 否则deficit无法累积，调度循环不会退出
+        future = asyncio.get_running_loop().create_future()
+        flow = self._flows.get(flow_key)
+        if flow is None:
+            flow = self._flows[flow_key] = _Flow(flow_key, weight)
+            self._active.append(flow)
+        flow.weight = weight
+        flow.waiters.append((user_key, future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except BaseException as exc:
+            if future.done() and not future.cancelled():
+                self._release(user_key)  # 名额已分配但调用方已放弃
+            else:
+                self._remove_waiter(flow, user_key, future)
+            if isinstance(exc, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                logger.warning(f"LLM调度排队超时: flow={flow_key}, user={user_key}, 调度指标: {self.metrics}")
+            raise
+        try:
+            yield
+        finally:
+            self._release(user_key)
+
+    def _release(self, user_key):
+        self._inflight -= 1
+        self._user_inflight[user_key] -= 1
+        if self._user_inflight[user_key] <= 0:
+            del self._user_inflight[user_key]
+        self._dispatch()
+
+    def _remove_waiter(self, flow, user_key, future):
+        try:
+            flow.waiters.remove((user_key, future))
+        except ValueError:
+            pass
+        if not flow.waiters:
+            self._drop_flow(flow)
+        self._dispatch()
+
+    def _drop_flow(self, flow):
+        try:
+            self._active.remove(flow)
+        except ValueError:
+            pass
+        self._flows.pop(flow.key, None)
+
+    def _eligible_index(self, flow):
+        """流中第一个未超过用户在途上限的等待者"""
+        for index, (user_key, future) in enumerate(flow.waiters):
+            if self._user_inflight.get(user_key, 0) < self.user_inflight_limit:  # 只读，不为等待中的用户创建条目
+                return index
+        return None
+
+    def _dispatch(self):
+        while self._inflight < self.capacity and self._active:
+            has_eligible = False
+            for _ in range(len(self._active)):
+                flow = self._active[0]
+                index = self._eligible_index(flow)
+                if index is None:
+                    self._active.rotate(-1)
+                    continue
+                has_eligible = True
+                if flow.deficit < 1:
+                    flow.deficit += self.quantum * flow.weight
+                    if flow.deficit < 1:
+                        self._active.rotate(-1)
+                        continue
+                user_key, future = flow.waiters[index]
+                del flow.waiters[index]
+                if future.done():
+                    # 等待者已超时或被取消但尚未执行清理（同一轮事件循环中），跳过且不消耗额度
+                    if not flow.waiters:
+                        flow.deficit = 0.0
+                        self._drop_flow(flow)
+                    break
+                flow.deficit -= 1
+                self._inflight += 1
+                self._user_inflight[user_key] += 1
+                self.stats["granted"] += 1
+                future.set_result(None)
+                if not flow.waiters:
+                    flow.deficit = 0.0
+                    self._drop_flow(flow)
+                elif flow.deficit < 1:
+                    self._active.rotate(-1)
+                break
+            else:
+                if not has_eligible:
+                    return
@@ -1,164 +1,282 @@
 import asyncio
 import json
+import time
+from typing import NamedTuple
 
 import lark_oapi as lark
+from lark_oapi.event.callback.model.p2_card_action_trigger import P2CardActionTrigger, P2CardActionTriggerResponse
 
 from configs.settings import settings
-from controllers.lark_client import Feishu
+from controllers.admission import AdmissionQueue
+from controllers.card_pool import CardPool
+from controllers.card_streamer import CardStreamer
+from controllers.fair_scheduler import FairScheduler
+from controllers.generation_registry import Generation, GenerationRegistry
+from controllers.lark_client import Feishu, loop
+from controllers.lark_ratelimit import FeishuRateLimiter
 from controllers.llm_client import DifyClient
-from utils.logger import get_logger
+from controllers.user_directory import UserDirectory
+from db.session_store import SessionStore
+from utils.dedupe import TTLDeduper
+from utils.logger import get_logger, sample_payload, truncate
+from utils.metrics import registry, pool_state
+from utils.response_cache import ResponseCache
+from utils.spool import ByteBudget
+from utils.status import system_sampler
 
 logger = get_logger()
 
+
+class InboundEvent(NamedTuple):
+    """确认前从事件中提取的精简记录，入队后再解析"""
+    message_id: str
+    message_type: str
+    chat_type: str
+    chat_id: str
+    open_id: str
+    content: str
+    received_at: float
+
+
 class FeishuRobot:
     def __init__(self):
-        self.processed_message_ids = set()  # 用于记录已处理的消息ID
-        self.user_info = {}
         model_name = settings.fs_model_name
-        base_url = settings.config.llm_models[model_name].base_url
-        chat_endpoint = settings.config.llm_models[model_name].chat_endpoint
-        conv_endpoint = settings.config.llm_models[model_name].conv_endpoint
+        config = settings.config  # 同一份配置快照
+        model_config = config.llm_models[model_name]
+        base_url = model_config.base_url
+        chat_endpoint = model_config.chat_endpoint
+        conv_endpoint = model_config.conv_endpoint
         api_key = settings.dify_fs_secret
-        concurrency_limit = settings.config.llm_models[model_name].concurrency_limit
-        timeout = settings.config.llm_models[model_name].timeout
+        concurrency_limit = model_config.concurrency_limit
+        timeout = model_config.timeout
+        cache_ttl = model_config.cache_ttl
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        self.conv_limit = settings.config.llm_models[model_name].conv_limit
-        self.sort_by = settings.config.llm_models[model_name].sort_by
-        self.params = settings.config.llm_param[model_name]
+        self.conv_limit = model_config.conv_limit
+        self.sort_by = model_config.sort_by
+        self.params = config.llm_param[model_name]
         self.max_retries = settings.max_retries
+        feishu_config = config.feishu
+        self.card_flush_interval_ms = feishu_config.card_flush_interval_ms
+        self.card_flush_chars = feishu_config.card_flush_chars
+        self.file_spool_max_size = feishu_config.file_spool_max_size
+        self.file_chunk_size = feishu_config.file_chunk_size
+        self.file_budget = ByteBudget(feishu_config.file_byte_budget)  # 限制同时处理的文件总字节数
+        self.admission = AdmissionQueue(feishu_config.queue_size, feishu_config.worker_count)
+        self.ack_latency = registry.histogram("feishu_event_ack_seconds", "飞书事件回调的确认耗时").labels()
+        self.scheduler_config = config.scheduler
+        self.vip_open_ids = set(self.scheduler_config.vip_open_ids)
+        self.scheduler = FairScheduler(concurrency_limit, self.scheduler_config.user_inflight_limit,
+                                       self.scheduler_config.quantum, self.scheduler_config.max_wait)
+        self.generations = GenerationRegistry()
+        # 用于记录已处理的消息ID，按插入顺序和TTL淘汰
+        self.message_deduper = TTLDeduper(feishu_config.dedupe_ttl, feishu_config.dedupe_max_size, feishu_config.dedupe_db_path or None)
         self.feishu_client = None
-        self.dify_fs_client = DifyClient(base_url, chat_endpoint, conv_endpoint, headers, concurrency_limit, timeout)
+        self.card_pool = None
+        self.user_directory = None
+        self.config_watcher = None
+        session_config = config.session
+        self.session_store = SessionStore(settings.database_url, session_config.ttl, session_config.max_size,
+                                          session_config.flush_interval, session_config.flush_batch)
+        # 开启cache_ttl后，新会话中的常见问题（FAQ）直接回放缓存答案
+        cache_config = config.response_cache
+        response_cache = ResponseCache(cache_config.max_entries, cache_config.max_bytes, cache_config.db_path or None,
+                                       cache_config.replay_chunk_chars) if cache_ttl > 0 else None
+        self.dify_fs_client = DifyClient(base_url, chat_endpoint, conv_endpoint, headers, concurrency_limit, timeout,
+                                         response_cache=response_cache, cache_ttl=cache_ttl, endpoints=model_config.endpoints,
+                                         lb_strategy=model_config.lb_strategy, eject_failures=model_config.eject_failures,
+                                         eject_seconds=model_config.eject_seconds, first_token_timeout=model_config.first_token_timeout,
+                                         hedge_budget=model_config.hedge_budget, adaptive_limit=model_config.adaptive_limit,
+                                         circuit_breaker=model_config.circuit_breaker, fallback_answer=model_config.fallback_answer)
+        # 调度容量跟随LLM客户端的自适应并发上限，后端过载时的排队仍按公平调度进行
+        self.dify_fs_client.limiter.subscribe(self.scheduler.set_capacity)
+        settings.config_cache.subscribe(self.apply_config)
         logger.info("Dify client init success!")
 
+    def apply_config(self, config):
+        """配置文件热加载后应用可在线调整的参数；连接地址、队列和存储等参数仍需重启生效"""
+        model_config = config.llm_models[settings.fs_model_name]
+        self.conv_limit = model_config.conv_limit
+        self.sort_by = model_config.sort_by
+        self.params = config.llm_param[settings.fs_model_name]
+        self.card_flush_interval_ms = config.feishu.card_flush_interval_ms
+        self.card_flush_chars = config.feishu.card_flush_chars
+        self.scheduler_config = config.scheduler
+        self.vip_open_ids = set(self.scheduler_config.vip_open_ids)
+        self.dify_fs_client.reconfigure(model_config)
+        self.scheduler.reconfigure(int(self.dify_fs_client.limiter.limit), self.scheduler_config.user_inflight_limit,
+                                   self.scheduler_config.quantum, self.scheduler_config.max_wait)
+        monitor_config = config.monitor
+        system_sampler.reconfigure(monitor_config.interval, monitor_config.gpu, monitor_config.gpu_interval, monitor_config.gpu_idle)
+        logger.info(f"飞书机器人已应用新配置: concurrency_limit={model_config.concurrency_limit}, LLM并发上限={self.dify_fs_client.limiter.limit:.1f}, "
+                    f"调度容量={self.scheduler.capacity}, timeout={model_config.timeout}")
+
     def run(self):
         # 注册事件 Register event
         event_handler = lark.EventDispatcherHandler.builder("", "") \
             .register_p2_im_message_receive_v1(self.do_p2_im_message_receive_v1) \
+            .register_p2_card_action_trigger(self.do_p2_card_action_trigger) \
             .build()
         # 初始化飞书客户端
         app_id = settings.app_id
         app_secret = settings.app_secret
-        self.feishu_client = Feishu(app_id, app_secret, event_handler)
+        feishu_config = settings.config.feishu
+        rate_limiter = FeishuRateLimiter(feishu_config.api_rate_limits, feishu_config.api_default_rate, feishu_config.card_update_rate)
+        self.feishu_client = Feishu(app_id, app_secret, event_handler, feishu_config.concurrency_limit,
+                                    feishu_config.max_keepalive_connections, feishu_config.keepalive_expiry, feishu_config.timeout,
+                                    rate_limiter, self.max_retries, feishu_config.api_retry_base_delay, feishu_config.api_retry_max_delay)
+        self.user_directory = UserDirectory(self.feishu_client, feishu_config.user_cache_ttl, feishu_config.user_cache_max_size,
+                                            feishu_config.user_cache_stale_ttl, feishu_config.chat_prefetch_interval)
+        self.card_pool = CardPool(self.feishu_client, feishu_config.card_pool_size, feishu_config.card_pool_max_age,
+                                  feishu_config.card_pool_refill_interval)
+        self.session_store.start(loop)
+        self.admission.start(loop)
+        self.card_pool.start(loop)
+        monitor_config = settings.config.monitor
+        system_sampler.reconfigure(monitor_config.interval, monitor_config.gpu, monitor_config.gpu_interval, monitor_config.gpu_idle)
+        system_sampler.start(loop)
+        self.config_watcher = loop.create_task(settings.config_cache.watch())
+        self.register_metrics()
         logger.info("Feishu client running...")
         self.feishu_client.start()
 
+    def register_metrics(self):
+        """队列深度、在途生成数和连接池状态在/metrics抓取时读取"""
+        registry.gauge("feishu_admission_queue_depth", "准入队列中等待处理的事件数", lambda: self.admission.depth)
+        registry.counter("feishu_admission_rejected", "准入队列已满被拒绝的事件数", callback=lambda: self.admission.stats["rejected"])
+        registry.gauge("llm_scheduler_waiting", "公平调度中等待LLM名额的请求数", lambda: self.scheduler.metrics["waiting"])
+        registry.gauge("llm_scheduler_inflight", "公平调度已放行的请求数", lambda: self.scheduler.metrics["inflight"])
+        registry.gauge("feishu_inflight_generations", "正在生成中的回答数", lambda: len(self.generations))
+        registry.gauge("feishu_card_pool_available", "卡片池中可用的预创建卡片数", lambda: self.card_pool.metrics["available"])
+        registry.gauge("httpx_pool_connections", "httpx连接池的连接和排队请求数",
+                       lambda: {("feishu", state): value for state, value in pool_state(self.feishu_client.transport.client).items()},
+                       ("pool", "state"))
+        self.dify_fs_client.register_metrics("feishu")
+
     def terminate(self):
         logger.info("Feishu client terminating...")
+        if self.config_watcher is not None:
+            self.config_watcher.cancel()
+        loop.run_until_complete(self.admission.close())
+        loop.run_until_complete(self.card_pool.close())
+        loop.run_until_complete(system_sampler.close())
         self.feishu_client.stop()
-
-    def add_message_id(self, msg_id):
-        self.processed_message_ids.add(msg_id)
-        
-        # 当集合大小超过1000时触发清理
-        if len(self.processed_message_ids) > 1000:
-            # 转换为列表并截取后半部分（保留最近添加的）
-            ids_list = list(self.processed_message_ids)
-            keep_ids = set(ids_list[len(ids_list)//2:])  # 取后50%
-            self.processed_message_ids.clear()
-            self.processed_message_ids.update(keep_ids)
+        self.message_deduper.close()
+        self.session_store.close()
+        if self.dify_fs_client.response_cache is not None:
+            self.dify_fs_client.response_cache.close()
 
     def do_p2_im_message_receive_v1(self, data: lark.im.v1.P2ImMessageReceiveV1) -> None:
-        """飞书消息处理入口 - 必须在3秒内响应确认，长任务应该异步处理"""
-        # 尝试获取或创建事件循环
+        """飞书消息处理入口 - 必须在3秒内响应确认，这里只做校验、去重和入队，所有网络调用都在确认之后进行"""
+        started = time.perf_counter()
         try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()  # 手动创建
-            asyncio.set_event_loop(loop)  # 将新循环绑定到当前线程
-        # 提取消息基本信息
+            # 提取消息基本信息
+            event = data.event
+            message = event.message if event else None
+            sender_id = event.sender.sender_id if event and event.sender else None
+            if message is None or sender_id is None or not message.message_id:
+                logger.warning("收到不完整的飞书消息事件，已忽略")
+                return
+            message_id = message.message_id
+            # 检查是否已处理过
+            if self.message_deduper.seen(message_id):
+                logger.info(f'忽略重复的消息: {message_id}, 去重统计: {self.message_deduper.stats}')
+                return
+            record = InboundEvent(message_id, message.message_type, message.chat_type, message.chat_id,
+                                  sender_id.open_id, message.content, time.time())
+            logger.info(f'接收到新的飞书消息: message_id={message_id}, message_type={record.message_type}')
+            # 提交到准入队列，队列已满时快速回复繁忙
+            if not self.admission.submit(f"{record.message_type}:{message_id}", self.handle_event, record):
+                self.reply_busy(record.chat_type, record.open_id, record.chat_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.ack_latency.observe(elapsed)
+            logger.opt(lazy=True).debug("事件确认耗时: {:.3f}ms, 统计: {}", lambda: elapsed * 1000, self.ack_latency.snapshot)
+
+    def do_p2_card_action_trigger(self, data: P2CardActionTrigger) -> P2CardActionTriggerResponse:
+        """卡片回调入口：处理流式卡片上的停止按钮"""
         event = data.event
-        message = event.message
-        message_id = message.message_id
-        message_type = message.message_type
-        chat_type = message.chat_type
-        chat_id = message.chat_id
-        sender = event.sender
-        sender_id = sender.sender_id
-        open_id = sender_id.open_id
-        # user_id = sender_id.user_id
-        # 检查是否已处理过
-        if message_id in self.processed_message_ids:
-            logger.info(f'忽略重复的消息: {message_id} {data.event.message.content}')
-            return
-        self.add_message_id(message_id)
-        logger.info(f'接收到新的飞书消息')
-        logger.debug(f'新的飞书消息: {lark.JSON.marshal(data, indent=4)}')
-        # 用户信息
-        user_name = self.feishu_client.get_user_name(open_id)
-        old_conversation_id = self.user_info.setdefault(user_name, {}).setdefault('conversation_id', '')
-        logger.info(f"用户: user_name={user_name}, open_id={open_id}, conversation_id={old_conversation_id}")
+        value = (event.action.value if event and event.action else None) or {}
+        if value.get("action") != "stop_generation" or event.context is None or event.operator is None:
+            return P2CardActionTriggerResponse({})
+        stopped = self.generations.stop(event.context.open_message_id, event.operator.open_id)
+        logger.info(f"收到停止生成请求: message_id={event.context.open_message_id}, stopped={stopped}, 统计: {self.generations.stats}")
+        toast = {"type": "info", "content": "已停止生成" if stopped else "当前没有进行中的回答"}
+        return P2CardActionTriggerResponse({"toast": toast})
 
+    async def handle_event(self, record):
+        """确认之后的消息处理：解析消息内容并分发"""
+        message_id, message_type, chat_type, chat_id, open_id, content, _ = record
+        # 消息原文在确认之后按采样率记录，并截断超长内容
+        if sample_payload():
+            logger.debug(f"新的飞书消息: message_id={message_id}, chat_type={chat_type}, content={truncate(content)}")
         # 处理文件类型消息
         if message_type == "text":
             # 解析用户消息
             try:
-                content = data.event.message.content
-                content_json = json.loads(content)
-                text = content_json.get('text', '')
+                text = json.loads(content).get('text', '')
                 logger.info(f"收到文字消息: message_id={message_id}, text={text}")
             except Exception as err:
                 logger.error(f"消息处理异常: {err}")
-                return  # 立即返回成功确认
+                return
             # 处理重置指令
             if text in {'重置', '清空对话。', '/reset'}:
                 logger.info(f"准备发起新的会话")
-                try:
-                    self.user_info[user_name]["conversation_id"] = ''
-                    self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text":"会话已重置"}))
-                    logger.info(f'会话重置成功， 已将原会话ID ```{old_conversation_id}``` 重置为新的会话ID： ```{self.user_info[user_name]["conversation_id"]}```')
-
-                    return  # 立即返回成功确认
-                except Exception as err:
-                    logger.error(f"会话重置信息发送失败: {err}")
-                    return  # 立即返回成功确认
-            
-            # 异步处理复杂的消息处理逻辑，尽量减少同步处理时间, 避免超时
-            try:
-                # 创建异步任务并添加回调处理
-                loop.create_task(self.text_messages_handler(user_name, chat_type, open_id, chat_id, text))
-                logger.info("异步任务已后台提交到事件循环")
-            except Exception as err:
-                logger.error(f"用户信息处理失败: {message_id}, {str(err)}")
+                await self.reset_conversation_handler(chat_type, open_id, chat_id)
                 return
+            await self.text_messages_handler(chat_type, open_id, chat_id, text)
 
         elif message_type == "file":
             # 解析文件信息
             try:
-                content = data.event.message.content
                 content_json = json.loads(content)
                 file_key = content_json.get('file_key', '')
                 file_name = content_json.get('file_name', '')
                 logger.info(f"收到文件消息: message_id={message_id}, file_key={file_key}, file_name={file_name}")
-                loop.create_task(self.file_message_handle("download_and_upload", message_id, chat_type, open_id, chat_id, file_key, file_name))
-                # 发送消息告诉用户文件在处理中，请稍等
-                self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件正在处理中，请稍等..."}))
-                logger.info("异步任务已后台提交到事件循环")
-                return
             except Exception as err:
                 logger.error(f"解析文件消息异常: {str(err)}")
-                self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "解析文件消息出错，请重试"}))
+                await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "解析文件消息出错，请重试"}))
                 return
-        
+            # 发送消息告诉用户文件在处理中，请稍等
+            self.admission.spawn(self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件正在处理中，请稍等..."})))
+            await self.file_message_handle("download_and_upload", message_id, chat_type, open_id, chat_id, file_key, file_name)
+
         # 处理其他非文本消息
         else:
-            self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", '{"text":"没有理解您的信息，我现在只支持文本和文件消息哦~"}')
-            return  # 立即返回成功确认
-        
-    async def text_messages_handler(self, user_name, chat_type, open_id, chat_id, query):
-        """处理消息的异步核心逻辑"""
-        card_id = await self.feishu_client.create_card()
-        sequence = 0
-        # 发送初始卡片并确保流式更新模式开启
-        response = await self.feishu_client.send_init_card(card_id, chat_type == "p2p", open_id, chat_id)
-        sequence += 1
-        logger.debug(f"飞书响应: code={response.code}, msg={response.msg}, data={getattr(response, 'data', None)}, log_id={response.get_log_id()}")
+            await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", '{"text":"没有理解您的信息，我现在只支持文本和文件消息哦~"}')
 
+    def reply_busy(self, chat_type, open_id, chat_id):
+        """准入队列已满时的快速降级回复"""
+        self.admission.spawn(self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "当前咨询人数较多，请稍后重试"})))
+
+    async def get_user_info(self, chat_type, open_id, chat_id):
+        """获取用户名及其会话信息"""
+        if chat_type != "p2p":
+            self.user_directory.schedule_prefetch_chat(chat_id)  # 群聊后台批量预取成员用户名
+        user_name = await self.user_directory.get_name(open_id)
+        session_key = self.session_store.session_key(chat_type, open_id, chat_id)
+        conversation_id = self.session_store.get(session_key).get('conversation_id', '')
+        logger.info(f"用户: user_name={user_name}, open_id={open_id}, session_key={session_key}, conversation_id={conversation_id}")
+        return user_name, session_key, conversation_id
+
+    async def reset_conversation_handler(self, chat_type, open_id, chat_id):
+        """处理重置指令"""
+        try:
+            user_name, session_key, old_conversation_id = await self.get_user_info(chat_type, open_id, chat_id)
+            new_conversation_id = self.session_store.update(session_key, conversation_id='', user_name=user_name)['conversation_id']
+            await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text":"会话已重置"}))
+            logger.info(f'会话重置成功， 已将原会话ID ```{old_conversation_id}``` 重置为新的会话ID： ```{new_conversation_id}```')
+        except Exception as err:
+            logger.error(f"会话重置信息发送失败: {err}")
+
+    async def text_messages_handler(self, chat_type, open_id, chat_id, query):
+        """处理消息的异步核心逻辑"""
+        user_name, session_key, conversation_id = await self.get_user_info(chat_type, open_id, chat_id)
         params = self.params.model_dump()
         params["query"] = query
         params["user"] = user_name
-        params["conversation_id"] = self.user_info[user_name].get("conversation_id", '')
+        params["conversation_id"] = conversation_id
         conv_params = {"user": user_name, "limit": self.conv_limit, "sort_by": self.sort_by}
-        kwargs = {"user_info": self.user_info, "conv_params": conv_params}
+        kwargs = {"session_store": self.session_store, "session_key": session_key, "conv_params": conv_params}
         # answer = await self.dify_fs_client.get_completion(params, **kwargs)
         # # 使用重试机制更新卡片
         # for retry in range(self.max_retries):
@@ -180,62 +298,109 @@ class FeishuRobot:
         #             logger.error(f"更新卡片失败: {str(err)}")
         #             return None
 
-        answer = ''
-        generator = self.dify_fs_client.get_stream_completion(params, **kwargs)
-        async for content in generator:
-            if not content:
-                continue    
-            answer += content
-            # 使用重试机制更新卡片
-            for retry in range(self.max_retries):
-                try:
-                    # 使用asyncio.create_task来避免阻塞
-                    response = await self.feishu_client.update_card(card_id, answer, sequence)
-                    if sequence <= 1:
-                        logger.info(f"卡片更新成功！sequence={sequence}. ---\n... ...\n---")
-                        logger.debug(f"飞书响应: code={response.code}, msg={response.msg}, data={getattr(response, 'data', None)}, log_id={response.get_log_id()}---\n... ...\n---")
-                    else:
-                        logger.debug(f"卡片更新成功！sequence={sequence}. \n飞书响应: code={response.code}, msg={response.msg}, data={getattr(response, 'data', None)}, log_id={response.get_log_id()}")
-                    sequence += 1
-                    break
-                except Exception as err:
-                    if retry < self.max_retries - 1:
-                        logger.warning(f"更新卡片失败 (重试 {retry+1}/{self.max_retries}): \n{str(err)}")
-                        await asyncio.sleep(0.2)  # 短暂等待后重试
-                    else:
-                        logger.error(f"更新卡片失败: {str(err)}")
-                        return None
+        # 合并增量并按时间/字数窗口刷新卡片，避免每个分块都发起一次OpenAPI调用；卡片就绪前的增量先缓存
+        streamer = CardStreamer(self.feishu_client, None, 1, self.card_flush_interval_ms, self.card_flush_chars)
+        # 登记本次生成：同一会话的新消息或卡片上的停止按钮会取消它
+        generation = Generation(session_key, open_id, user_name, None)
+        kwargs["stream_meta"] = generation.meta
+        # LLM请求与卡片准备并发进行，首字延迟约为两者中的较大值而非之和
+        generation.task = asyncio.ensure_future(self.generate(streamer, chat_type, open_id, chat_id, params, kwargs))
+        self.generations.supersede(generation)
+        card_setup = asyncio.ensure_future(self.setup_card(generation, streamer, chat_type, open_id, chat_id))
+        try:
+            await asyncio.wait({generation.task, card_setup})
+        except asyncio.CancelledError:
+            generation.task.cancel()
+            card_setup.cancel()
+            raise
+        finally:
+            self.generations.remove(generation)
+        if generation.task.cancelled():
+            await self.interrupt_generation(generation, streamer)
+        elif generation.task.exception() is not None:
+            raise generation.task.exception()
         return None
 
+    async def setup_card(self, generation, streamer, chat_type, open_id, chat_id):
+        """取预创建的卡片并发送初始卡片，失败时取消本次生成"""
+        try:
+            card_id = await self.card_pool.acquire()
+            if not card_id:
+                raise Exception("创建卡片失败")
+            # 发送初始卡片并确保流式更新模式开启
+            response = await self.feishu_client.send_init_card(card_id, chat_type == "p2p", open_id, chat_id)
+        except Exception as err:
+            logger.error(f"准备卡片失败: {err}")
+            streamer.abort()
+            self.generations.cancel(generation, "card_failed")
+            self.admission.spawn(self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "回复失败，请重试"})))
+            return
+        logger.opt(lazy=True).debug("飞书响应: code={}, msg={}, data={}, log_id={}", lambda: response.code, lambda: response.msg,
+                                    lambda: getattr(response, 'data', None), response.get_log_id)
+        generation.card_id = card_id
+        self.generations.bind_message(generation, getattr(response.data, 'message_id', None) if response.data else None)
+        streamer.bind_card(card_id)
+
+    async def generate(self, streamer, chat_type, open_id, chat_id, params, kwargs):
+        """经公平调度获得LLM并发名额后再发起请求，避免个别用户占满后端"""
+        flow_key = open_id if chat_type == "p2p" else chat_id
+        try:
+            async with self.scheduler.slot(flow_key, open_id, self.flow_weight(chat_type, open_id)):
+                generator = self.dify_fs_client.get_stream_completion(params, **kwargs)
+                await streamer.run(generator)
+        except asyncio.TimeoutError:
+            await streamer.finish("当前咨询人数较多，请稍后重试")
+
+    async def interrupt_generation(self, generation, streamer):
+        """生成被取代、停止或卡片准备失败后：通知Dify停止后台生成，并把旧卡片标记为已中断"""
+        logger.info(f"生成已中断: reason={generation.stop_reason}, card_id={generation.card_id}, task_id={generation.meta.get('task_id')}")
+        task_id = generation.meta.get("task_id")
+        if task_id:
+            self.admission.spawn(self.dify_fs_client.stop_generation(task_id, generation.user_name, generation.meta.get("endpoint")))
+        if streamer.card_id is not None:
+            await streamer.finish("\n\n> 已中断" if streamer.answer else "已中断")
+
+    def flow_weight(self, chat_type, open_id):
+        """调度权重：VIP用户最高，单聊高于群聊"""
+        if open_id in self.vip_open_ids:
+            return self.scheduler_config.vip_weight
+        return self.scheduler_config.p2p_weight if chat_type == "p2p" else self.scheduler_config.group_weight
+
     async def file_message_handle(self, operation_type, message_id, chat_type, open_id, chat_id, file_key=None, file_name=''):
+        file_obj = None
+        reserved = 0
         try:
-            file_content = b''
-            download_name = ''
+            # 下载文件（上传同样需要先下载），分块写入临时文件并占用字节预算
+            file_obj, download_name, reserved = await self.feishu_client.download_message_file(
+                message_id, file_key, self.file_budget, self.file_spool_max_size, self.file_chunk_size)
+            if file_obj is None:
+                logger.error(f"下载文件失败: file_key={file_key}, file_name={file_name}")
+                await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件下载失败，请重试"}))
+                return
             if "download" in operation_type:
-                # 下载文件
-                file_content, _ = await self.feishu_client.download_message_file(message_id, file_key)
-                if not file_content:
-                    logger.error(f"下载文件失败: file_key={file_key}, file_name={file_name}")
-                    self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件下载失败，请重试"}))
-                    return
                 # 发送成功消息
                 logger.info(f"文件下载成功!")
-                self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件下载成功"}))
-            elif "upload" in operation_type:
+                await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件下载成功"}))
+            if "upload" in operation_type:
                 # 上传文件
                 file_name_to_use = file_name or download_name
-                result = await self.feishu_client.upload_file_to_approval(file_content, file_name_to_use)
+                result = await self.feishu_client.upload_file_to_approval(file_obj, file_name_to_use)
                 if not result or "code" not in result:
                     logger.error(f"上传文件失败: {result}")
-                    self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "上传文件失败，请重试"}))
+                    await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "上传文件失败，请重试"}))
                     return
                 # 发送成功消息和文件code
                 logger.info(f"文件上传成功!\n文件code: {result['code']}")
-                self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件上传成功"}))
+                await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "文件上传成功"}))
         except Exception as err:
             logger.error(f"处理文件异常: {str(err)}")
-            self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "处理文件时发生错误，请重试"}))
+            await self.feishu_client.send_common_message(chat_type == "p2p", open_id, chat_id, "text", json.dumps({"text": "处理文件时发生错误，请重试"}))
             return
+        finally:
+            if file_obj is not None:
+                file_obj.close()
+            if reserved:
+                await self.file_budget.release(reserved)
 
     # async def chat(self, query):
     #     """微信消息处理核心逻辑"""
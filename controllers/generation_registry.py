@@ -0,0 +1,68 @@
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class Generation:
+    """一次进行中的流式生成"""
+
+    def __init__(self, key, open_id, user_name, card_id):
+        self.key = key  # 会话key，同一会话同时只保留一个生成
+        self.open_id = open_id
+        self.user_name = user_name
+        self.card_id = card_id
+        self.message_id = None  # 卡片消息ID，用于定位卡片上的停止按钮
+        self.task = None
+        self.meta = {}  # 流中解析出的task_id等信息
+        self.stop_reason = None
+
+
+class GenerationRegistry:
+    """按会话登记进行中的生成：新消息或停止按钮会取消旧的生成"""
+
+    def __init__(self):
+        self.stats = {"started": 0, "superseded": 0, "stopped": 0}
+        self._by_key = {}
+        self._by_message_id = {}
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def supersede(self, generation):
+        """登记新的生成，并取消同一会话中仍在进行的旧生成"""
+        self.stats["started"] += 1
+        previous = self._by_key.get(generation.key)
+        self._by_key[generation.key] = generation
+        if previous is not None and self.cancel(previous, "superseded"):
+            self.stats["superseded"] += 1
+            logger.info(f"新消息取代了进行中的生成: key={generation.key}, card_id={previous.card_id}")
+        return previous
+
+    def bind_message(self, generation, message_id):
+        generation.message_id = message_id
+        if message_id:
+            self._by_message_id[message_id] = generation
+
+    def stop(self, message_id, open_id):
+        """卡片停止按钮：只允许提问者停止自己的生成"""
+        generation = self._by_message_id.get(message_id)
+        if generation is None or generation.open_id != open_id:
+            return False
+        if self.cancel(generation, "stopped"):
+            self.stats["stopped"] += 1
+            return True
+        return False
+
+    @staticmethod
+    def cancel(generation, reason):
+        if generation.task is None or generation.task.done():
+            return False
+        generation.stop_reason = reason
+        generation.task.cancel()
+        return True
+
+    def remove(self, generation):
+        if self._by_key.get(generation.key) is generation:
+            del self._by_key[generation.key]
+        if generation.message_id and self._by_message_id.get(generation.message_id) is generation:
+            del self._by_message_id[generation.message_id]
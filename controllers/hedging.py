@@ -0,0 +1,27 @@
+class HedgeBudget:
+    """对冲预算：每个请求积累ratio个额度，发送一次对冲消耗1个，使对冲请求不超过总请求的ratio；最多积累burst个"""
+
+    def __init__(self, ratio=0.1, burst=5):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stats = {"requests": 0, "first_token_timeouts": 0, "hedged": 0, "hedge_wins": 0, "exhausted": 0}
+
+    @property
+    def metrics(self):
+        requests = self.stats["requests"]
+        return {**self.stats, "tokens": round(self.tokens, 2),
+                "hedge_rate": round(self.stats["hedged"] / requests, 4) if requests else 0.0}
+
+    def deposit(self):
+        self.stats["requests"] += 1
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        self.stats["first_token_timeouts"] += 1
+        if self.tokens < 1:
+            self.stats["exhausted"] += 1
+            return False
+        self.tokens -= 1
+        self.stats["hedged"] += 1
+        return True
@@ -1,19 +1,21 @@
 # SDK 使用说明 SDK user guide：https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/server-side-sdk/python--sdk/preparations-before-development
-import asyncio
 import io
 import json
 import traceback
 import uuid
 
 import lark_oapi as lark
-import requests
 from lark_oapi.api.cardkit.v1 import ContentCardElementRequest, ContentCardElementRequestBody, \
     ContentCardElementResponse, CreateCardRequest, CreateCardRequestBody, CreateCardResponse
 from lark_oapi.api.contact.v3 import *
 from lark_oapi.api.im.v1 import *
+from lark_oapi.core.model import Config
+from lark_oapi.core.utils import Files
 from lark_oapi.ws.exception import ClientException
 
+from controllers.lark_transport import FeishuTransport
 from utils.logger import get_logger
+from utils.spool import SpoolReader, spool_response
 from utils.loop import get_loop
 
 logger = get_logger()
@@ -51,16 +53,40 @@ class Feishu:
                     "tag": "markdown",
                     "content": "思考中",
                     "element_id": "markdown_1"
+                },
+                {
+                    "tag": "button",
+                    "element_id": "stop_button",
+                    "text": {
+                        "tag": "plain_text",
+                        "content": "停止生成"
+                    },
+                    "type": "default",
+                    "size": "small",
+                    "behaviors": [
+                        {
+                            "type": "callback",
+                            "value": {"action": "stop_generation"}
+                        }
+                    ]
                 }
             ]
         }
     }
 
-    def __init__(self, client_id, client_secret, event_handler):
+    def __init__(self, client_id, client_secret, event_handler, concurrency_limit=20, max_keepalive_connections=10, keepalive_expiry=30, timeout=10,
+                 rate_limiter=None, max_retries=3, retry_base_delay=0.2, retry_max_delay=5.0):
         self.client_id = client_id
         self.client_secret = client_secret
         self.cli = lark.ws.Client(client_id, client_secret, event_handler=event_handler, log_level=lark.LogLevel.DEBUG)
-        self.client = lark.Client.builder().app_id(client_id).app_secret(client_secret).build()
+        self._card_data = json.dumps(self.card_template)  # 卡片模板只序列化一次
+        config = Config()
+        config.app_id = client_id
+        config.app_secret = client_secret
+        # OpenAPI调用统一走异步连接池，避免阻塞共享的事件循环
+        self.transport = FeishuTransport(config, concurrency_limit, max_keepalive_connections, keepalive_expiry, timeout,
+                                         rate_limiter=rate_limiter, max_retries=max_retries, retry_base_delay=retry_base_delay,
+                                         retry_max_delay=retry_max_delay)
 
     def __getattr__(self, name):
         """当访问不存在的属性或方法时自动尝试从cli对象获取"""
@@ -90,6 +116,7 @@ class Feishu:
     def stop(self):
         try:
             loop.run_until_complete(self._disconnect())
+            loop.run_until_complete(self.transport.close())
             logger.info("disconnect success.")
         except Exception as e:
             logger.error(f"disconnect failed, err: {e}")
@@ -101,11 +128,11 @@ class Feishu:
         create_card_request: CreateCardRequest = CreateCardRequest.builder() \
             .request_body(CreateCardRequestBody.builder()
                           .type("card_json")
-                          .data(json.dumps(self.card_template)
+                          .data(self._card_data
                                 ).build()).build()
 
         # 发起请求
-        create_card_response: CreateCardResponse = self.client.cardkit.v1.card.create(create_card_request)
+        create_card_response: CreateCardResponse = await self.transport.call(create_card_request, CreateCardResponse, api="create_card")
         if not create_card_response.success():
             logger.error(
                 f"client.cardkit.v1.card.create failed, code: {create_card_response.code}, msg: {create_card_response.msg}, log_id: {create_card_response.get_log_id()}, resp: \n{json.dumps(json.loads(create_card_response.raw.content), indent=4, ensure_ascii=False)}")
@@ -114,48 +141,32 @@ class Feishu:
 
     async def send_init_card(self, card_id, is_p2p, open_id, chat_id):
         if is_p2p:
-            response = self._send_message("open_id", open_id, "interactive", "{\"type\":\"card\",\"data\":{\"card_id\":\"" + card_id + "\"}}")
+            response = await self._send_message("open_id", open_id, "interactive", "{\"type\":\"card\",\"data\":{\"card_id\":\"" + card_id + "\"}}")
         else:
-            response = self._send_message("chat_id", chat_id, "interactive", "{\"type\":\"card\",\"data\":{\"card_id\":\"" + card_id + "\"}}")
+            response = await self._send_message("chat_id", chat_id, "interactive", "{\"type\":\"card\",\"data\":{\"card_id\":\"" + card_id + "\"}}")
         return response
 
     async def update_card(self, card_id, content, sequence=0):
-        # 发送消息 Send a message
-        # # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-        max_retries = 3
-        retry_delay = 0.5  # 减少初始重试延迟
-        # 添加重试机制
-        for retry in range(max_retries):
-            try:
-                content_card_element_request: ContentCardElementRequest = ContentCardElementRequest.builder() \
-                    .card_id(card_id) \
-                    .element_id("markdown_1") \
-                    .request_body(ContentCardElementRequestBody.builder()
-                                  .uuid(str(uuid.uuid4()))
-                                  .content(content)
-                                  .sequence(sequence)
-                                  .build()) \
-                    .build()
-                content_card_element_response: ContentCardElementResponse = self.client.cardkit.v1.card_element.content(
-                    content_card_element_request)
-                if not content_card_element_response.success():
-                    raise Exception(
-                        f"client.im.v1.chat.create failed, code: {content_card_element_response.code}, msg: {content_card_element_response.msg}, log_id: {content_card_element_response.get_log_id()}, resp: \n{json.dumps(json.loads(content_card_element_response.raw.content), indent=4, ensure_ascii=False)}"
-                    )
-                return content_card_element_response
-            except Exception as e:
-                if "Server Internal Error" in str(e) and retry < max_retries - 1:
-                    logger.warning(f"飞书服务器错误，第{retry + 1}次重试，将在{retry_delay}秒后重试")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 1.5  # 减少指数退避增长率
-                    return None
-                else:
-                    if retry >= max_retries - 1:
-                        logger.error(f"更新卡片失败，已重试{max_retries}次: {str(e)}")
-                    raise  # 重试用尽，重新抛出
-        return None
+        # 流式更新卡片文本 https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/cardkit-v1/card-element/content
+        # 限流和重试由传输层统一处理，重试复用同一个uuid，服务端据此去重
+        content_card_element_request: ContentCardElementRequest = ContentCardElementRequest.builder() \
+            .card_id(card_id) \
+            .element_id("markdown_1") \
+            .request_body(ContentCardElementRequestBody.builder()
+                          .uuid(str(uuid.uuid4()))
+                          .content(content)
+                          .sequence(sequence)
+                          .build()) \
+            .build()
+        content_card_element_response: ContentCardElementResponse = await self.transport.call(
+            content_card_element_request, ContentCardElementResponse, api="update_card")
+        if not content_card_element_response.success():
+            raise Exception(
+                f"client.cardkit.v1.card_element.content failed, code: {content_card_element_response.code}, msg: {content_card_element_response.msg}, log_id: {content_card_element_response.get_log_id()}"
+            )
+        return content_card_element_response
 
-    def _send_message(self, receive_id_type, receive_id, msg_type, content):
+    async def _send_message(self, receive_id_type, receive_id, msg_type, content):
         create_send_message_request: CreateMessageRequest = (
             CreateMessageRequest.builder()
             .receive_id_type(receive_id_type)
@@ -164,24 +175,26 @@ class Feishu:
                 .receive_id(receive_id)
                 .msg_type(msg_type)
                 .content(content)
+                .uuid(str(uuid.uuid4()))  # 重试时复用，避免重复发送
                 .build()
             )
             .build()
         )
-        create_send_message_response: CreateMessageResponse = self.client.im.v1.message.create(create_send_message_request)
+        create_send_message_response: CreateMessageResponse = await self.transport.call(create_send_message_request, CreateMessageResponse, api="send_message")
         if not create_send_message_response.success():
             raise Exception(
                 f"client.im.v1.message.create failed, code: {create_send_message_response.code}, msg: {create_send_message_response.msg}, log_id: {create_send_message_response.get_log_id()}"
             )
         return create_send_message_response
 
-    def send_common_message(self, is_p2p, open_id, chat_id, msg_type, content):
+    async def send_common_message(self, is_p2p, open_id, chat_id, msg_type, content):
         if is_p2p:
-            self._send_message("open_id", open_id, msg_type, content)
+            response = await self._send_message("open_id", open_id, msg_type, content)
         else:
-            self._send_message("chat_id", chat_id, msg_type, content)
+            response = await self._send_message("chat_id", chat_id, msg_type, content)
+        return response
 
-    def get_user_name(self, open_id):
+    async def get_user_name(self, open_id):
         # 构造请求对象
         get_user_name_request: GetUserRequest = GetUserRequest.builder() \
             .user_id(open_id) \
@@ -189,7 +202,7 @@ class Feishu:
             .build()
 
         # 发起请求
-        get_user_name_response: GetUserResponse = self.client.contact.v3.user.get(get_user_name_request)
+        get_user_name_response: GetUserResponse = await self.transport.call(get_user_name_request, GetUserResponse)
         # 处理失败返回
         if not get_user_name_response.success():
             lark.logger.error(
@@ -198,14 +211,55 @@ class Feishu:
 
         return get_user_name_response.data.user.name
 
-    async def download_message_file(self, message_id, file_key):
+    async def batch_get_user_names(self, open_ids):
+        """批量获取用户名（单次最多50个），返回 {open_id: name}"""
+        batch_user_request: BatchUserRequest = BatchUserRequest.builder() \
+            .user_ids(open_ids) \
+            .user_id_type("open_id") \
+            .build()
+
+        batch_user_response: BatchUserResponse = await self.transport.call(batch_user_request, BatchUserResponse)
+        if not batch_user_response.success():
+            logger.error(
+                f"client.contact.v3.user.batch failed, code: {batch_user_response.code}, msg: {batch_user_response.msg}, log_id: {batch_user_response.get_log_id()}")
+            return {}
+        return {user.open_id: user.name for user in batch_user_response.data.items or [] if user.open_id}
+
+    async def get_chat_member_ids(self, chat_id, page_size=100):
+        """获取群成员的open_id列表"""
+        member_ids = []
+        page_token = None
+        while True:
+            builder = GetChatMembersRequest.builder() \
+                .chat_id(chat_id) \
+                .member_id_type("open_id") \
+                .page_size(page_size)
+            if page_token:
+                builder = builder.page_token(page_token)
+            get_chat_members_response: GetChatMembersResponse = await self.transport.call(builder.build(), GetChatMembersResponse)
+            if not get_chat_members_response.success():
+                logger.error(
+                    f"client.im.v1.chat_members.get failed, code: {get_chat_members_response.code}, msg: {get_chat_members_response.msg}, log_id: {get_chat_members_response.get_log_id()}")
+                break
+            data = get_chat_members_response.data
+            member_ids.extend(member.member_id for member in data.items or [])
+            if not data.has_more or not data.page_token:
+                break
+            page_token = data.page_token
+        return member_ids
+
+    async def download_message_file(self, message_id, file_key, byte_budget=None, spool_max_size=8 * 1024 * 1024, chunk_size=64 * 1024):
         """
-        下载聊天消息中的文件
+        分块下载聊天消息中的文件到临时文件，避免整个文件常驻内存
         :params message_id: 消息ID
         :params file_key: 文件的唯一标识
-        :return: (file_content, file_name) 文件二进制内容和文件名
+        :params byte_budget: 可选的字节预算，拿到响应头后按文件大小占用，写入超出时追加，调用方用完文件后需释放
+        :params spool_max_size: 超过该大小的文件落盘保存
+        :params chunk_size: 分块读取大小
+        :return: (file_obj, file_name, reserved) 临时文件对象、文件名和占用的预算字节数
         """
         logger.info(f"开始下载消息文件: message_id={message_id}, file_key={file_key}")
+        reserved = 0
         try:
             # 构造请求获取文件资源
             download_message_file_request = GetMessageResourceRequest.builder() \
@@ -214,58 +268,52 @@ class Feishu:
                 .type("file") \
                 .build()
             # 发起请求
-            download_message_file_response = self.client.im.v1.message_resource.get(download_message_file_request)
+            async with self.transport.stream(download_message_file_request) as download_message_file_response:
+                # 处理失败返回
+                if not 200 <= download_message_file_response.status_code < 300:
+                    logger.error(
+                        f"下载文件失败: status_code={download_message_file_response.status_code}, resp={(await download_message_file_response.aread())[:500]}"
+                    )
+                    return None, None, 0
+                if byte_budget is not None:
+                    size = int(download_message_file_response.headers.get("Content-Length") or spool_max_size)
+                    reserved = await byte_budget.acquire(size)
 
-            # 处理失败返回
-            if not download_message_file_response.success():
-                logger.error(
-                    f"下载文件失败: code={download_message_file_response.code}, msg={download_message_file_response.msg}, log_id={download_message_file_response.get_log_id()}"
+                # 从响应中分块读取文件内容，并获取文件名
+                # 没有Content-Length时按spool_max_size预占，实际写入超出后再追加
+                file_obj, reserved = await spool_response(
+                    download_message_file_response, spool_max_size, chunk_size, byte_budget, reserved
                 )
-                return None, None
+                file_name = Files.parse_file_name(download_message_file_response.headers)
 
-            # 从响应中获取文件内容和文件名
-            file_content = download_message_file_response.file.read()
-            file_name = download_message_file_response.file_name
-
-            logger.info(f"文件下载成功: {file_name}, 大小: {len(file_content)} 字节")
-            return file_content, file_name
+            file_size = file_obj.seek(0, io.SEEK_END)
+            file_obj.seek(0)
+            logger.info(f"文件下载成功: {file_name}, 大小: {file_size} 字节")
+            return file_obj, file_name, reserved
 
         except Exception as e:
             logger.error(f"下载文件异常: {str(e)}")
             logger.error(traceback.format_exc())
-            return None, None
+            if reserved:
+                await byte_budget.release(reserved)
+            return None, None, 0
 
     async def upload_file_to_approval(self, file_content, file_name, file_type="attachment"):
         """
-        上传文件到审批系统
-        :params file_content: 文件二进制内容
+        上传文件到审批系统，文件对象按块流式编码为multipart，不做整体拷贝
+        :params file_content: 文件二进制内容或可读的文件对象
         :params file_name: 文件名
         :params file_type: 文件类型，attachment表示附件，image表示图片
         :return: 文件code和url的字典
         """
         logger.info(f"开始上传文件到审批系统: {file_name}")
         try:
-            # 直接使用requests获取tenant_access_token，避免SDK兼容性问题
-            token_url = 'https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal'
-            token_data = {
-                "app_id": self.client_id,
-                "app_secret": self.client_secret
-            }
-            token_response = requests.post(token_url, json=token_data)
-            token_result = token_response.json()
-            if token_response.status_code != 200 or token_result.get('code') != 0:
-                logger.error(f"获取tenant_access_token失败: {token_result}")
-                return None
-            tenant_access_token = token_result.get('tenant_access_token')
-
-            # 准备上传文件
+            # 准备上传文件，tenant_access_token由共享的token管理器提供
             upload_file_url = "https://www.feishu.cn/approval/openapi/v2/file/upload"
-            headers = {
-                "Authorization": f"Bearer {tenant_access_token}"
-            }
+            headers = await self.transport.auth_headers()
             # 准备multipart/form-data格式的数据，与Java代码保持一致
             files = {
-                'content': (file_name, io.BytesIO(file_content)),
+                'content': (file_name, file_content if isinstance(file_content, bytes) else SpoolReader(file_content)),
             }
             data = {
                 'name': file_name,
@@ -273,7 +321,7 @@ class Feishu:
             }
 
             # 发送请求
-            upload_file_response = requests.post(upload_file_url, headers=headers, files=files, data=data)
+            upload_file_response = await self.transport.client.post(upload_file_url, headers=headers, files=files, data=data)
             # 检查响应
             if upload_file_response.status_code != 200:
                 logger.error(f"上传文件到审批系统失败: status_code={upload_file_response.status_code}, response={upload_file_response.text}")
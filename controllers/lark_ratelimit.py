@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """令牌桶：预约式获取，令牌不足时按先后顺序计算等待时长，不需要轮询"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate  # 每秒令牌数
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        self._refill()
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def pause(self, seconds):
+        """服务端限流时至少暂停seconds秒发放令牌，之后的预约顺延"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+class FeishuRateLimiter:
+    """飞书OpenAPI客户端限流：按接口族（如im.messages、cardkit.cards）和单张卡片分别限流"""
+
+    def __init__(self, rates=None, default_rate=50.0, card_rate=10.0, max_cards=10000):
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self.card_rate = card_rate
+        self.max_cards = max_cards
+        self.stats = {"acquired": 0, "throttled": 0, "wait_total": 0.0, "paused": 0}
+        self._families = {}
+        self._cards = OrderedDict()  # card_id -> TokenBucket，按最近使用淘汰
+
+    @property
+    def metrics(self):
+        return {**self.stats, "wait_total": round(self.stats["wait_total"], 3), "families": len(self._families),
+                "cards": len(self._cards)}
+
+    @staticmethod
+    def family(uri):
+        """/open-apis/{服务}/{版本}/{资源}/... -> 服务.资源"""
+        parts = uri.split("/")
+        return f"{parts[2]}.{parts[4]}" if len(parts) > 4 else uri
+
+    async def acquire(self, family, card_id=None):
+        delay = self._bucket(family).reserve()
+        if card_id:
+            delay = max(delay, self._card_bucket(card_id).reserve())
+        self.stats["acquired"] += 1
+        if delay > 0:
+            self.stats["throttled"] += 1
+            self.stats["wait_total"] += delay
+            await asyncio.sleep(delay)
+        return delay
+
+    def pause(self, family, seconds, card_id=None):
+        self.stats["paused"] += 1
+        self._bucket(family).pause(seconds)
+        if card_id:
+            self._card_bucket(card_id).pause(seconds)
+
+    def _bucket(self, family):
+        bucket = self._families.get(family)
+        if bucket is None:
+            bucket = self._families[family] = TokenBucket(self.rates.get(family, self.default_rate))
+        return bucket
+
+    def _card_bucket(self, card_id):
+        bucket = self._cards.get(card_id)
+        if bucket is None:
+            bucket = self._cards[card_id] = TokenBucket(self.card_rate)
+            if len(self._cards) > self.max_cards:
+                self._cards.popitem(last=False)
+        else:
+            self._cards.move_to_end(card_id)
+        return bucket
@@ -0,0 +1,32 @@
+import httpx
+
+from utils.token_cache import TokenCache
+
+
+class TenantTokenManager:
+    """tenant_access_token 管理：缓存至过期前，提前在后台刷新，并发调用方共享同一次刷新"""
+    token_endpoint = "/open-apis/auth/v3/tenant_access_token/internal"
+
+    def __init__(self, client: httpx.AsyncClient, app_id, app_secret, refresh_ahead=600, min_valid=30):
+        self.client = client
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.cache = TokenCache(self._fetch, "tenant_access_token", refresh_ahead, min_valid)
+
+    @property
+    def fetch_count(self):
+        return self.cache.fetch_count
+
+    async def get_token(self) -> str:
+        return await self.cache.get()
+
+    def invalidate(self):
+        """token被服务端判定失效时调用，下次获取将强制刷新"""
+        self.cache.invalidate()
+
+    async def _fetch(self):
+        response = await self.client.post(self.token_endpoint, json={"app_id": self.app_id, "app_secret": self.app_secret})
+        result = response.json()
+        if response.status_code != 200 or result.get('code') != 0:
+            raise RuntimeError(f"获取tenant_access_token失败: {result}")
+        return result['tenant_access_token'], result.get('expire', 7200)
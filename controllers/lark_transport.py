@@ -0,0 +1,188 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Type, TypeVar
+
+import httpx
+from lark_oapi.core import JSON
+from lark_oapi.core.const import UTF_8, PROJECT, VERSION, USER_AGENT, AUTHORIZATION, CONTENT_TYPE, APPLICATION_JSON
+from lark_oapi.core.enum import AccessTokenType
+from lark_oapi.core.model import BaseRequest, BaseResponse, Config, RawResponse, RequestOption
+from lark_oapi.core.token import verify
+
+from controllers.lark_ratelimit import FeishuRateLimiter
+from controllers.lark_token import TenantTokenManager
+from utils.logger import get_logger
+from utils.metrics import registry
+
+logger = get_logger()
+
+T = TypeVar("T", bound=BaseResponse)
+
+api_latency = registry.histogram("feishu_api_seconds", "飞书OpenAPI调用耗时（含限流等待和重试）", ("api",))
+api_retries = registry.counter("feishu_api_retries", "飞书OpenAPI调用重试次数", ("api",))
+
+
+class FeishuTransport:
+    """飞书OpenAPI异步传输层：复用SDK的请求模型，通过连接池化的httpx.AsyncClient发送，不阻塞事件循环；
+    所有调用统一限流和重试"""
+    rate_limit_codes = {99991400}  # 请求频率超限
+    invalid_token_codes = {99991661, 99991663, 99991668}  # tenant_access_token缺失或失效
+
+    def __init__(self, config: Config, concurrency_limit=20, max_keepalive_connections=10, keepalive_expiry=30, timeout=10, http2=True,
+                 rate_limiter: Optional[FeishuRateLimiter] = None, max_retries=3, retry_base_delay=0.2, retry_max_delay=5.0):
+        self.config = config
+        limits = httpx.Limits(max_connections=concurrency_limit, max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        self.client = httpx.AsyncClient(base_url=config.domain, limits=limits, timeout=httpx.Timeout(timeout),
+                                        http2=http2, follow_redirects=True)
+        self.token_manager = TenantTokenManager(self.client, config.app_id, config.app_secret)
+        self.rate_limiter = rate_limiter or FeishuRateLimiter()
+        self.max_retries = max(1, max_retries)  # 总尝试次数
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "token_refreshed": 0, "failed": 0}
+
+    @property
+    def metrics(self):
+        return {**self.stats, "rate_limiter": self.rate_limiter.metrics}
+
+    async def close(self):
+        await self.client.aclose()  # 显式关闭连接池
+
+    async def execute(self, request: BaseRequest, option: Optional[RequestOption] = None) -> RawResponse:
+        """发送SDK构造的请求，返回原始响应"""
+        http_request = await self._build_request(request, option)
+        response = await self.client.send(http_request)
+        raw = RawResponse()
+        raw.status_code = response.status_code
+        raw.headers = response.headers  # 保留httpx.Headers，按名称读取时不区分大小写
+        raw.content = response.content
+        return raw
+
+    async def call(self, request: BaseRequest, response_cls: Type[T], option: Optional[RequestOption] = None, api=None) -> T:
+        """发送请求并反序列化为SDK响应对象：按接口族和card_id限流；网络错误、5xx和频率超限按带抖动的指数退避重试，
+        频率超限时按服务端给出的重置时间暂停同族请求；重试发送同一请求体，其中的幂等uuid保持不变。
+        api为指标标签，默认使用接口族"""
+        family = self.rate_limiter.family(request.uri)
+        card_id = (request.paths or {}).get("card_id")
+        self.stats["calls"] += 1
+        api = api or family
+        start = time.perf_counter()
+        try:
+            return await self._call(request, response_cls, option, family, card_id, api)
+        finally:
+            api_latency.labels(api).observe(time.perf_counter() - start)
+
+    async def _call(self, request, response_cls, option, family, card_id, api):
+        for attempt in range(self.max_retries):
+            last_attempt = attempt == self.max_retries - 1
+            await self.rate_limiter.acquire(family, card_id)
+            try:
+                raw = await self.execute(request, option)
+            except httpx.TransportError as exc:
+                if last_attempt:
+                    self.stats["failed"] += 1
+                    raise
+                delay = self._backoff(attempt)
+                reason = f"{type(exc).__name__}: {exc}"
+            else:
+                response = self._unmarshal(raw, response_cls)
+                delay, reason = self._retry_delay(raw, response, attempt, family, card_id, option)
+                if delay is None or last_attempt:
+                    if delay is not None:
+                        self.stats["failed"] += 1
+                    return response
+            self.stats["retries"] += 1
+            api_retries.labels(api).inc()
+            logger.warning(f"飞书接口调用失败，{delay:.2f}秒后第{attempt + 1}次重试: {family}, card_id={card_id}, {reason}")
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, raw, response, attempt, family, card_id, option):
+        """返回(重试前等待的秒数, 原因)，不需要重试时等待秒数为None"""
+        code = getattr(response, "code", None)
+        reason = f"status_code={raw.status_code}, code={code}, msg={getattr(response, 'msg', None)}"
+        if raw.status_code == 429 or code in self.rate_limit_codes:
+            self.stats["rate_limited"] += 1
+            reset = raw.headers.get("x-ogw-ratelimit-reset") or raw.headers.get("Retry-After")
+            delay = float(reset) if reset and reset.isdigit() else self._backoff(attempt)
+            self.rate_limiter.pause(family, delay, card_id)
+            return delay + random.uniform(0, self.retry_base_delay), reason
+        if code in self.invalid_token_codes:
+            self.stats["token_refreshed"] += 1
+            self.token_manager.invalidate()
+            if option is not None:
+                option.tenant_access_token = None
+            return 0.0, reason
+        if raw.status_code >= 500 or "internal error" in str(getattr(response, "msg", "") or "").lower():
+            return self._backoff(attempt), reason
+        return None, reason
+
+    def _backoff(self, attempt):
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _unmarshal(raw, response_cls):
+        try:
+            response = JSON.unmarshal(str(raw.content, UTF_8), response_cls)
+        except ValueError:
+            # 网关错误等非JSON响应
+            response = response_cls()
+            response.code = raw.status_code
+            response.msg = str(raw.content[:200], UTF_8, errors="replace")
+        response.raw = raw
+        return response
+
+    @asynccontextmanager
+    async def stream(self, request: BaseRequest, option: Optional[RequestOption] = None):
+        """以流式方式发送请求，响应体需由调用方分块读取"""
+        await self.rate_limiter.acquire(self.rate_limiter.family(request.uri))
+        http_request = await self._build_request(request, option)
+        response = await self.client.send(http_request, stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def _build_request(self, request: BaseRequest, option: Optional[RequestOption] = None) -> httpx.Request:
+        option = option or RequestOption()
+        await self._authorize(request, option)
+        uri = request.uri
+        for key, value in (request.paths or {}).items():
+            uri = uri.replace(":" + key, value)
+        headers = self._build_headers(request, option)
+        content = None
+        if request.body is not None:
+            content = JSON.marshal(request.body).encode(UTF_8)
+            headers[CONTENT_TYPE] = f"{APPLICATION_JSON}; charset=utf-8"
+        return self.client.build_request(str(request.http_method.name), uri, headers=headers,
+                                         params=request.queries, content=content)
+
+    async def auth_headers(self):
+        """供原始HTTP调用使用的鉴权请求头"""
+        return {AUTHORIZATION: f"Bearer {await self.token_manager.get_token()}"}
+
+    async def _authorize(self, request: BaseRequest, option: RequestOption):
+        """鉴权、获取 token：tenant_access_token 由共享的token管理器提供"""
+        if AccessTokenType.TENANT in request.token_types and not option.tenant_access_token:
+            option.tenant_access_token = await self.token_manager.get_token()
+            request.token_types = {AccessTokenType.TENANT}
+        elif request.token_types:
+            # 其他token类型仍由SDK获取（可能同步请求），放到线程中避免阻塞事件循环
+            await asyncio.to_thread(verify, self.config, request, option)
+
+    @staticmethod
+    def _build_headers(request: BaseRequest, option: RequestOption):
+        headers = dict(request.headers or {})
+        headers[USER_AGENT] = f"{PROJECT}/v{VERSION}"
+        headers.update(option.headers or {})
+        for token_type in request.token_types:
+            if AccessTokenType.TENANT == token_type:
+                headers[AUTHORIZATION] = f"Bearer {option.tenant_access_token}"
+            elif AccessTokenType.APP == token_type:
+                headers[AUTHORIZATION] = f"Bearer {option.app_access_token}"
+            elif AccessTokenType.USER == token_type:
+                headers[AUTHORIZATION] = f"Bearer {option.user_access_token}"
+        return headers
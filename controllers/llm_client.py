@@ -1,17 +1,35 @@
+import asyncio
 import json
+import time
 from contextlib import asynccontextmanager
 from typing import Optional, Any, Callable, AsyncGenerator
 
 import httpx
 
+from controllers.adaptive_limit import AdaptiveLimiter, CircuitBreaker
+from controllers.endpoint_pool import EndpointPool
+from controllers.hedging import HedgeBudget
+from models.config_schemas import AdaptiveLimitConfig, CircuitBreakerConfig
+from models.exception_model import LLMUnavailableException
 from utils.exception import llm_exception
-from utils.logger import get_logger
+from utils.logger import get_logger, PayloadRecorder, payload_sampled, sample_payload, truncate
+from utils.metrics import registry, pool_state
+from utils.sse import SSEDecoder, json_loads
+from utils.response_cache import ResponseCache
 
 logger = get_logger()
 
+first_token_latency = registry.histogram("llm_first_token_seconds", "LLM流式回答的首个token耗时（含排队和对冲）")
+token_rate = registry.histogram("llm_tokens_per_second", "LLM流式回答首个token之后的输出速率（按流式增量计）",
+                                buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500))
+
 
 class BaseLLMClient:
-    def __init__(self, base_url, chat_endpoint, headers, concurrency_limit=10, timeout=30, callback_parser: Optional[Callable[[Any], Any]] = None, **kwargs):
+    def __init__(self, base_url, chat_endpoint, headers, concurrency_limit=10, timeout=30, callback_parser: Optional[Callable[[Any], Any]] = None,
+                 response_cache: Optional[ResponseCache] = None, cache_ttl=0, sse_capture=20, endpoints=None,
+                 lb_strategy="least_outstanding", eject_failures=3, eject_seconds=30.0, first_token_timeout=0, hedge_budget=0.1,
+                 adaptive_limit: Optional[AdaptiveLimitConfig] = None, circuit_breaker: Optional[CircuitBreakerConfig] = None,
+                 fallback_answer="当前咨询人数较多，请稍后重试", **kwargs):
         self.base_url = base_url
         self.chat_endpoint = chat_endpoint
         self.headers = headers
@@ -19,37 +37,269 @@ class BaseLLMClient:
         self.stream_parser = callback_parser or self._default_stream_parser
         self.make_request = self._make_request
         self.make_stream_request = self._make_stream_request
-        # 配置连接池参数（等效于原TCPConnector）
-        self.client = httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=concurrency_limit),
-            timeout=httpx.Timeout(timeout), http2=True, follow_redirects=True)
+        self.response_cache = response_cache  # 可选的应答缓存，按模型配置cache_ttl开启
+        self.cache_ttl = cache_ttl
+        self.sse_capture = sse_capture  # 诊断用，只保留最近的SSE事件
+        # 未配置endpoints时只有base_url一个后端；每个后端独立连接池
+        endpoints = [(endpoint.base_url, endpoint.weight, endpoint.api_key) for endpoint in endpoints] if endpoints else [(base_url, 1.0, None)]
+        adaptive_limit = adaptive_limit or AdaptiveLimitConfig()
+        circuit_breaker = circuit_breaker or CircuitBreakerConfig()
+        max_concurrency = max(concurrency_limit, adaptive_limit.max_concurrency)
+        self.endpoints = EndpointPool(endpoints, headers, max_concurrency, timeout, lb_strategy, eject_failures, eject_seconds)
+        self.concurrency_limit = concurrency_limit
+        self.first_token_timeout = first_token_timeout  # 首个token的等待时长，超时后发送对冲请求，0表示不对冲
+        self.hedge_budget = HedgeBudget(hedge_budget)
+        # 并发上限从concurrency_limit开始，按后端时延和错误在[min_concurrency, max_concurrency]内自适应
+        self.limiter = AdaptiveLimiter(concurrency_limit, min(adaptive_limit.min_concurrency, concurrency_limit), max_concurrency,
+                                       adaptive_limit.latency_threshold, max_wait=adaptive_limit.max_wait)
+        self.breaker = CircuitBreaker(circuit_breaker.error_threshold, circuit_breaker.min_requests, circuit_breaker.window,
+                                      circuit_breaker.open_seconds)
+        self.fallback_answer = fallback_answer
+        self._background_tasks = set()
 
     async def close(self):
-        await self.client.aclose()  # 显式关闭连接池
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.endpoints.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+    @property
+    def metrics(self):
+        return {"limiter": self.limiter.metrics, "breaker": self.breaker.metrics, "hedge": self.hedge_budget.metrics,
+                "endpoints": self.endpoints.metrics}
+
+    def register_metrics(self, client):
+        """把并发上限、熔断和各后端的状态注册到/metrics，抓取时读取，不影响请求路径"""
+        registry.gauge("llm_concurrency_limit", "LLM自适应并发上限", lambda: {client: self.limiter.limit}, ("client",))
+        registry.gauge("llm_inflight_requests", "LLM在途请求数", lambda: {client: self.limiter.metrics["inflight"]}, ("client",))
+        registry.gauge("llm_limiter_waiting", "等待LLM并发名额的请求数", lambda: {client: self.limiter.metrics["waiting"]}, ("client",))
+        registry.counter("llm_limiter_rejected", "排队超时被拒绝的LLM请求数", ("client",), lambda: {client: self.limiter.stats["rejected"]})
+        registry.gauge("llm_circuit_open", "LLM熔断器是否打开（半开也计为1）", lambda: {client: self.breaker.state != "closed"}, ("client",))
+        registry.counter("llm_hedged_requests", "发送的对冲请求数", ("client",), lambda: {client: self.hedge_budget.stats["hedged"]})
+        registry.gauge("llm_endpoint_inflight", "各LLM后端的在途请求数",
+                       lambda: {(client, endpoint.base_url): endpoint.inflight for endpoint in self.endpoints.endpoints}, ("client", "endpoint"))
+        registry.gauge("httpx_pool_connections", "httpx连接池的连接和排队请求数",
+                       lambda: {(f"{client}:{endpoint.base_url}", state): value for endpoint in self.endpoints.endpoints
+                                for state, value in pool_state(endpoint.client).items()}, ("pool", "state"))
+
+    def reconfigure(self, model_config):
+        """配置热加载后更新可在线调整的参数，后端列表和连接池大小需重启生效"""
+        self.endpoints.set_timeout(model_config.timeout)
+        self.cache_ttl = model_config.cache_ttl
+        self.first_token_timeout = model_config.first_token_timeout
+        self.hedge_budget.ratio = model_config.hedge_budget
+        # 与初始化一致：上限范围为[min_concurrency, max(concurrency_limit, max_concurrency)]；
+        # concurrency_limit变化时从新值重新自适应（连接池大小仍按启动时的配置）
+        adaptive_limit = model_config.adaptive_limit
+        concurrency_limit = model_config.concurrency_limit
+        limit = concurrency_limit if concurrency_limit != self.concurrency_limit else None
+        self.concurrency_limit = concurrency_limit
+        self.limiter.reconfigure(min(adaptive_limit.min_concurrency, concurrency_limit), max(concurrency_limit, adaptive_limit.max_concurrency),
+                                 adaptive_limit.latency_threshold, adaptive_limit.max_wait, limit)
+        circuit_breaker = model_config.circuit_breaker
+        self.breaker.reconfigure(circuit_breaker.error_threshold, circuit_breaker.min_requests, circuit_breaker.window,
+                                 circuit_breaker.open_seconds)
+        self.fallback_answer = model_config.fallback_answer
+
+    def cache_key(self, params):
+        """可缓存的请求返回缓存key：需开启缓存，且不携带服务端会话（conversation_id）"""
+        if self.response_cache is None or self.cache_ttl <= 0 or params.get("conversation_id"):
+            return None
+        return self.response_cache.make_key(params)
 
     async def get_completion(self, params, **kwargs) -> str:
         """统一请求入口，子类可覆盖具体解析逻辑"""
         try:
+            key = self.cache_key(params)
+            if key is not None:
+                return await self.response_cache.get_or_load(key, lambda: self.make_request(params, **kwargs), self.cache_ttl)
             answer = await self.make_request(params, **kwargs)
             return answer
+        except LLMUnavailableException as exc:
+            logger.warning(f"LLM后端暂不可用，返回降级回答: {exc}")
+            return self.fallback_answer
         except (httpx.HTTPError, httpx.RequestError, json.JSONDecodeError, KeyError, Exception) as exc:
             llm_exception(exc)
             return "调用LLM平台报错"
 
     async def get_stream_completion(self, params, **kwargs) -> AsyncGenerator[str, None]:
-        """统一流式请求入口，子类可覆盖具体解析逻辑"""
+        """统一流式请求入口，子类可覆盖具体解析逻辑；命中缓存时按分块回放答案"""
+        key = self.cache_key(params)
+        stream = (
+            self.response_cache.stream(key, lambda: self._shared_stream(params, **kwargs), self.cache_ttl)
+            if key is not None
+            else self._measured(self._hedged_stream(params, **kwargs))
+        )
         try:
-            async with self.make_stream_request(params, **kwargs) as generator:
-                async for content in generator:
-                    yield content
+            async for content in stream:
+                yield content
+        except LLMUnavailableException as exc:
+            logger.warning(f"LLM后端暂不可用，返回降级回答: {exc}")
+            yield self.fallback_answer
         except (httpx.HTTPError, httpx.RequestError, httpx.StreamError, httpx.RemoteProtocolError, json.JSONDecodeError, KeyError, Exception) as exc:
             llm_exception(exc)
             yield "调用LLM平台报错"
+        finally:
+            await stream.aclose()
+
+    async def _shared_stream(self, params, **kwargs):
+        """可被多个请求共享的上游流：使用独立的stream_meta，单个订阅方中断时不会按task_id停止其他人的生成；
+        所有订阅方都离开、上游被取消时再由abandon_stream清理"""
+        meta = kwargs["stream_meta"] = {}
+        completed = False
+        stream = self._measured(self._hedged_stream(params, **kwargs))
+        try:
+            async for content in stream:
+                yield content
+            completed = True
+        finally:
+            await stream.aclose()
+            if not completed:
+                self.abandon_stream(params, meta)
+
+    def abandon_stream(self, params, meta):
+        """共享的上游流未完成即结束时由子类停止后端生成"""
+
+    @staticmethod
+    async def _measured(stream):
+        """记录首个token耗时和之后的输出速率；缓存回放不经过这里，不计入"""
+        started = time.perf_counter()
+        first_at = None
+        chunks = 0
+        try:
+            async for content in stream:
+                if content:
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                        first_token_latency.observe(first_at - started)
+                    chunks += 1
+                yield content
+        finally:
+            await stream.aclose()
+            elapsed = time.perf_counter() - first_at if first_at is not None else 0.0
+            if chunks > 1 and elapsed > 0:
+                token_rate.observe((chunks - 1) / elapsed)
+
+    @asynccontextmanager
+    async def open_stream(self, method, url, affinity_key=None, endpoint=None, exclude=(), admitted: Optional[asyncio.Event] = None, **kwargs):
+        """经熔断器和自适应并发上限放行后，在负载均衡选出的后端上发起请求，记录首包时延；5xx/429视为后端失败。
+        admitted在获得并发名额时被设置，对冲据此从放行后开始计算首个token的等待时间"""
+        trial = self.breaker.before_request()
+        lease = None
+        try:
+            async with self.limiter.slot():
+                if admitted is not None:
+                    admitted.set()
+                async with self.endpoints.lease(affinity_key, endpoint, exclude) as lease:
+                    started = time.monotonic()
+                    async with lease.endpoint.client.stream(method, url, headers=lease.endpoint.headers, **kwargs) as response:
+                        self.endpoints.observe(lease, time.monotonic() - started)
+                        if response.status_code >= 500 or response.status_code == 429:
+                            lease.fail()
+                        yield lease.endpoint, response
+        finally:
+            succeeded = lease.succeeded if lease is not None else None
+            if succeeded is not None:
+                self.limiter.record(succeeded, lease.latency)
+            self.breaker.record(succeeded, trial)
+
+    async def _stream(self, params, **kwargs):
+        async with self.make_stream_request(params, **kwargs) as generator:
+            async for content in generator:
+                yield content
+
+    async def _hedged_stream(self, params, **kwargs):
+        """首个token超过first_token_timeout未到达时，向其他后端（会话所在或唯一后端时为同一后端）发送对冲请求，
+        先产出token的一路胜出，另一路被取消；对冲次数受预算限制。等待计时从主请求获得并发名额后开始，
+        在自适应并发上限处排队的时间不触发对冲"""
+        self.hedge_budget.deposit()
+        if self.first_token_timeout <= 0 or not self.hedgeable(params):
+            async for content in self._stream(params, **kwargs):
+                yield content
+            return
+        meta = kwargs.get("stream_meta")
+        if meta is None:
+            meta = kwargs["stream_meta"] = {}
+        admitted = asyncio.Event()
+        admission = asyncio.ensure_future(admitted.wait())
+        primary = self._stream(params, **{**kwargs, "admitted": admitted})
+        attempts = [(asyncio.ensure_future(primary.__anext__()), primary, meta)]  # (首个token, 流, meta)
+        hedge_allowed, winner, deadline = True, None, None
+        loop = asyncio.get_running_loop()
+        try:
+            while winner is None:
+                pending = {task for task, _, _ in attempts if not task.done()}
+                if not pending:
+                    raise attempts[0][0].exception()  # 所有请求都失败
+                if hedge_allowed and deadline is None and admitted.is_set():
+                    deadline = loop.time() + self.first_token_timeout
+                if hedge_allowed and deadline is None:
+                    done, _ = await asyncio.wait(pending | {admission}, return_when=asyncio.FIRST_COMPLETED)
+                    done.discard(admission)
+                    if not done:
+                        continue  # 主请求刚获得并发名额，开始计时
+                else:
+                    timeout = max(0.0, deadline - loop.time()) if hedge_allowed else None
+                    done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_allowed = False
+                    if not self.hedge_budget.withdraw():
+                        logger.warning(f"首个token超时但对冲预算不足，继续等待: {self.hedge_budget.metrics}")
+                        continue
+                    hedge_meta = {}
+                    hedge = self._stream(params, **{**kwargs, "stream_meta": hedge_meta,
+                                                    "exclude_endpoints": (self.endpoints.get(meta.get("endpoint")),)})
+                    attempts.append((asyncio.ensure_future(hedge.__anext__()), hedge, hedge_meta))
+                    logger.warning(f"首个token超过{self.first_token_timeout}秒未到达，已发送对冲请求: endpoint={meta.get('endpoint')}")
+                    continue
+                winner = next((attempt for attempt in attempts if attempt[0].done() and self._first_token_ok(attempt[0])), None)
+            task, stream, winner_meta = winner
+            losers = [attempt for attempt in attempts if attempt is not winner]
+            for loser in losers:
+                loser[0].cancel()
+            await asyncio.gather(*(loser[0] for loser in losers), return_exceptions=True)
+            for loser in losers:
+                self.settle_hedge(params, kwargs, winner_meta, loser[2])
+            if winner_meta is not meta:
+                self.hedge_budget.stats["hedge_wins"] += 1
+                meta.clear()
+                meta.update(winner_meta)
+            if isinstance(task.exception(), StopAsyncIteration):
+                return
+            yield task.result()
+            async for content in stream:
+                yield content
+        finally:
+            admission.cancel()
+            for task, _, _ in attempts:
+                task.cancel()
+            await asyncio.gather(*(task for task, _, _ in attempts), return_exceptions=True)
+            for _, stream, _ in attempts:
+                await stream.aclose()
+
+    @staticmethod
+    def _first_token_ok(task):
+        """首个token已产出，或流正常结束（空回答）"""
+        return task.exception() is None or isinstance(task.exception(), StopAsyncIteration)
+
+    def hedgeable(self, params):
+        """请求是否可以对冲，重复发送有副作用的请求由子类排除"""
+        return True
+
+    def settle_hedge(self, params, kwargs, winner_meta, loser_meta):
+        """对冲结束后由子类清理落败请求的副作用"""
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
 
     async def _make_request(self, params, **kwargs):
         """异步HTTP请求核心实现（httpx版）"""
         try:
-            logger.info(f"LLM request params: ---\n{params}\n---")
-            async with self.client.stream("POST", self.chat_endpoint, headers=self.headers, json=params) as response:
+            self.log_request(params)
+            async with self.open_stream("POST", self.chat_endpoint, json=params) as (_, response):
                 answer = await self.parser(response)  # 使用注入的解析器
             return answer
         except httpx.HTTPStatusError as exc:
@@ -61,8 +311,12 @@ class BaseLLMClient:
         """异步流式HTTP请求核心实现（httpx版）"""
         gen = None  # 显式初始化变量
         try:
-            logger.info(f"LLM request params: ---\n{params}\n---")
-            async with self.client.stream("POST", self.chat_endpoint, headers=self.headers, json=params) as response:
+            self.log_request(params)
+            stream_meta = kwargs.get("stream_meta")
+            async with self.open_stream("POST", self.chat_endpoint, exclude=kwargs.get("exclude_endpoints", ()), admitted=kwargs.get("admitted"),
+                                        json=params) as (endpoint, response):
+                if stream_meta is not None:
+                    stream_meta["endpoint"] = endpoint.base_url
                 gen = self.stream_parser(response)  # 使用注入的解析器
                 yield gen
         except httpx.HTTPStatusError as exc:
@@ -72,76 +326,105 @@ class BaseLLMClient:
             if hasattr(gen, 'aclose'):  # 检查是否为生成器
                 await gen.aclose()  # 显式关闭
 
-    async def _default_parser(self, response) -> str:
-        """默认解析逻辑, 动态解析响应：支持JSON和SSE"""
+    async def _default_parser(self, response, meta=None) -> str:
+        """默认解析逻辑, 动态解析响应：支持JSON和SSE, meta用于收集响应中的元信息（如conversation_id）"""
         await self.assert_response(response)
         content_type = (getattr(response, 'content_type', None) or response.headers.get('Content-Type', '') or '').lower()
         if content_type.split(';')[0].strip() == 'application/json':
-            response_data = "blocking...\n"
-            _, answer, response_data = await self.parse_json_response(response, response_data)
+            response_data = PayloadRecorder("blocking")
+            _, answer, response_data = await self.parse_json_response(response, response_data, meta)
+            payload = response_data.render
         elif content_type.split(';')[0].strip() == 'text/event-stream':
-            answer = ''
-            response_data = "streaming...\n"
-            async for line in response.aiter_lines():
-                content, answer, response_data = await self.parse_event_stream(line, answer, response_data)
-                if content is None:
-                    continue
+            decoder = SSEDecoder(self.sse_capture)
+            answer = self.finalize_answer(''.join([content async for content in self.parse_sse_stream(response, decoder, meta)]))
+            payload = decoder.render
         else:
             raise ValueError(f"Unsupported response.content_type: {content_type}")
-        logger.info(f'LLM response data[:500]: ===\n{response_data[:500]}\n===')
-        logger.info(f'LLM answer: {answer}')
+        self.log_response(answer, payload)
         return answer
 
-    async def _default_stream_parser(self, response) -> AsyncGenerator[str, None]:
-        """默认解析逻辑, 动态解析响应：支持JSON和SSE"""
+    async def _default_stream_parser(self, response, meta=None) -> AsyncGenerator[str, None]:
+        """默认解析逻辑, 动态解析响应：支持JSON和SSE, meta用于收集事件中的元信息（如task_id）"""
         await self.assert_response(response)
         content_type = (getattr(response, 'content_type', None) or response.headers.get('Content-Type', '') or '').lower()
         if content_type.split(';')[0].strip() == 'application/json':
-            response_data = "blocking...\n"
-            content, answer, response_data = await self.parse_json_response(response, response_data)
+            response_data = PayloadRecorder("blocking")
+            content, answer, response_data = await self.parse_json_response(response, response_data, meta)
+            payload = response_data.render
         elif content_type.split(';')[0].strip() == 'text/event-stream':
-            answer = ''
-            response_data = "streaming...\n"
-            async for line in response.aiter_lines():
-                content, answer, response_data = await self.parse_event_stream(line, answer, response_data)
-                if content is None:
-                    continue
+            decoder = SSEDecoder(self.sse_capture)
+            answer_parts = []
+            async for content in self.parse_sse_stream(response, decoder, meta):
+                answer_parts.append(content)
                 yield content
+            answer = self.finalize_answer(''.join(answer_parts))
             content = ''
+            payload = decoder.render
         else:
             raise ValueError(f"Unsupported response.content_type: {content_type}, text: {(await response.aread()).decode('utf-8')}.")
-        logger.info(f'LLM response data[:500]: ===\n{response_data[:500]}\n===')
-        logger.info(f'LLM answer: ===\n{answer}\n===')
+        self.log_response(answer, payload)
         yield content
 
+    async def parse_sse_stream(self, response, decoder, meta=None) -> AsyncGenerator[str, None]:
+        """按字节分块增量解码SSE，逐个事件提取增量内容"""
+        try:
+            async for chunk in response.aiter_bytes():
+                for event in decoder.feed(chunk):
+                    if content := self.parse_sse_event(event, meta):
+                        yield content
+            for event in decoder.close():
+                if content := self.parse_sse_event(event, meta):
+                    yield content
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.opt(lazy=True).warning("SSE事件解析失败，最近的事件: ===\n{}\n===", decoder.render)
+            raise
+
+    def parse_sse_event(self, event, meta=None):
+        data = event.data.strip()
+        if not data or data == "[DONE]" or not data.startswith("{"):
+            return None
+        return self.extract_content(event, json_loads(data), meta)
+
+    @staticmethod
+    def extract_content(event, data, meta=None):
+        """从一个SSE事件中提取增量内容（OpenAI格式），子类按平台格式覆盖"""
+        return data['choices'][0]['delta'].get('content', '') if data.get('choices') else ''
+
+    @staticmethod
+    def finalize_answer(answer):
+        return answer
+
+    @staticmethod
+    def log_request(params):
+        """请求摘要记INFO；完整参数只对采样到的请求截断后记DEBUG"""
+        logger.info(f"LLM request: user={params.get('user')}, conversation_id={params.get('conversation_id')}, "
+                    f"query={truncate(params.get('query') or '', 100)}")
+        if sample_payload():
+            logger.opt(lazy=True).debug("LLM request params: ---\n{}\n---", lambda: truncate(params))
+
+    @staticmethod
+    def log_response(answer, payload=None):
+        """payload为渲染响应原文的函数，只对采样到的请求调用"""
+        if payload is not None and payload_sampled():
+            logger.opt(lazy=True).debug("LLM response data: ===\n{}\n===", payload)
+        logger.opt(lazy=True).info("LLM answer: ===\n{}\n===", lambda: truncate(answer))
+
     @staticmethod
     async def assert_response(response):
         assert response.status_code == 200, f"LLM response session failed with status code: {response.status_code}, text: {(await response.aread()).decode('utf-8')}."
         logger.info(f'LLM response session successfully with status code: {response.status_code}')
 
     @staticmethod
-    async def parse_json_response(response, response_data):
+    async def parse_json_response(response, response_data, meta=None):
         response_json = (await response.aread()).decode('utf-8')  # 显式读取字节流按数据, 解码为字符串
         response_dict = json.loads(response_json)
         content = response_dict['choices'][0]['message'].get('content', '')
         if isinstance(content, list):
             content = next((item['text']['content'] for item in content if item.get('type') == 'text'), content)
-        response_data += response_json + '\n'
+        response_data.record(response_json)
         answer = content
         return content, answer, response_data
 
-    @staticmethod
-    async def parse_event_stream(line, answer, response_data):
-        response_data += line + '\n'
-        line = line.strip().replace('data: ', '', 1)
-        if not line or line == "[DONE]" or not line.startswith("{"):
-            return None, answer, response_data
-        data = json.loads(line)
-        choice = data['choices'][0]
-        if content := choice['delta'].get('content', ''):
-            answer += content
-        return content, answer, response_data
-
 class LLMClient(BaseLLMClient):
     # 通用逻辑
     async def get_completion(self, params, **kwargs) -> str:
@@ -188,14 +471,19 @@ class DifyClient(BaseLLMClient):
     async def _make_request(self, params, **kwargs):
         """异步HTTP请求核心实现（httpx版）"""
         try:
-            user_info = kwargs.get("user_info")  # 从kwargs获取
+            session_store = kwargs.get("session_store")  # 从kwargs获取
+            session_key = kwargs.get("session_key")  # 从kwargs获取
             conv_params = kwargs.get("conv_params")  # 从kwargs获取
-            user_name = params["user"]
-            logger.info(f"LLM request params: ---\n{params}\n---")
-            async with self.client.stream("POST", self.chat_endpoint, headers=self.headers, json=params) as response:
-                if not user_info[user_name]["conversation_id"]:
-                    await self.update_conversation_id(user_name, user_info, conv_params)
-                answer = await self.parser(response)  # 使用注入的解析器
+            meta = {}  # 收集响应中的conversation_id等信息
+            self.log_request(params)
+            async with self.open_stream("POST", self.chat_endpoint, params.get("conversation_id"), json=params) as (endpoint, response):
+                answer = await self.parser(response, meta)  # 使用注入的解析器
+            self.endpoints.bind(meta.get("conversation_id"), endpoint)
+            if session_store is not None and not params.get("conversation_id"):
+                if meta.get("conversation_id"):
+                    self.save_conversation_id(params["user"], session_store, session_key, meta["conversation_id"])
+                else:
+                    await self.update_conversation_id(params["user"], session_store, session_key, conv_params, endpoint)
             return answer
         except httpx.HTTPStatusError as exc:
             logger.error(f'LLM response failed with status code: {exc.response.status_code}, text: {exc.response.text}')
@@ -204,16 +492,26 @@ class DifyClient(BaseLLMClient):
     @asynccontextmanager
     async def _make_stream_request(self, params, **kwargs):
         """异步流式HTTP请求核心实现（httpx版）"""
+        gen = None  # 显式初始化变量
         try:
+            session_store = kwargs.get("session_store")  # 从kwargs获取
+            session_key = kwargs.get("session_key")  # 从kwargs获取
             conv_params = kwargs.get("conv_params")  # 从kwargs获取
-            user_info = kwargs.get("user_info")  # 从kwargs获取
-            user_name = params["user"]
-            logger.info(f"LLM request params: ---\n{params}\n---")
-            async with self.client.stream("POST", self.chat_endpoint, headers=self.headers, json=params) as response:
-                if not user_info[user_name]["conversation_id"]:
-                    await self.update_conversation_id(user_name, user_info, conv_params)
-                gen = self.stream_parser(response)  # 使用注入的解析器
+            self.log_request(params)
+            stream_meta = kwargs.get("stream_meta")  # 从kwargs获取，收集流中的task_id等信息
+            meta = stream_meta if stream_meta is not None else {}
+            new_conversation = session_store is not None and not params.get("conversation_id")
+            async with self.open_stream("POST", self.chat_endpoint, params.get("conversation_id"), exclude=kwargs.get("exclude_endpoints", ()),
+                                        admitted=kwargs.get("admitted"),
+                                        json=params) as (endpoint, response):
+                meta["endpoint"] = endpoint.base_url  # 停止生成时需发往同一后端
+                gen = self.stream_parser(response, meta)  # 使用注入的解析器
+                if new_conversation:
+                    gen = self._track_conversation(gen, meta, params["user"], session_store, session_key, endpoint)
                 yield gen
+            # 流中没有携带conversation_id时，才回退到查询会话列表
+            if new_conversation and not meta.get("conversation_id"):
+                await self.update_conversation_id(params["user"], session_store, session_key, conv_params, endpoint)
         except httpx.HTTPStatusError as exc:
             logger.error(f'LLM response failed with status code: {exc.response.status_code}, text: {exc.response.text}')
             raise
@@ -222,34 +520,87 @@ class DifyClient(BaseLLMClient):
                 await gen.aclose()  # 显式关闭
 
     @staticmethod
-    async def parse_json_response(response, response_data):
+    async def parse_json_response(response, response_data, meta=None):
         response_json = (await response.aread()).decode('utf-8')  # 显式读取字节流按数据, 解码为字符串
         response_dict = json.loads(response_json)
+        DifyClient.collect_meta(response_dict, meta)
         content = response_dict.get('answer', '')
-        response_data += response_json + '\n'
+        response_data.record(response_json)
         answer = content
         return content, answer, response_data
 
     @staticmethod
-    async def parse_event_stream(line, answer, response_data):
-        response_data += line + '\n'
-        line = line.strip().replace('data: ', '', 1)
-        if not line or line == "[DONE]" or not line.startswith("{"):
-            return None, answer, response_data
-        data = json.loads(line)
-        if content := data.get('answer', ''):
-            answer += content
-        return content, answer, response_data
+    def extract_content(event, data, meta=None):
+        """Dify事件：answer为增量内容，error事件表示生成失败"""
+        DifyClient.collect_meta(data, meta)
+        if data.get('event') == 'error':
+            raise ValueError(f"Dify stream error: status={data.get('status')}, code={data.get('code')}, message={data.get('message')}")
+        return data.get('answer', '')
 
-    async def update_conversation_id(self, user_name, user_info, conv_params):
-        get_response = await self.client.get(self.conv_endpoint, params=conv_params, headers=self.headers)
+    @staticmethod
+    def collect_meta(data, meta):
+        """记录Dify事件中的task_id（用于中断生成）以及conversation_id、message_id"""
+        if meta is None:
+            return
+        for key in ("task_id", "conversation_id", "message_id"):
+            if not meta.get(key) and data.get(key):
+                meta[key] = data[key]
+
+    async def stop_generation(self, task_id, user, base_url=None):
+        """停止Dify中正在进行的流式生成，base_url为生成所在的后端"""
+        try:
+            endpoint = self.endpoints.get(base_url) or self.endpoints.pick()
+            response = await endpoint.client.post(f"{self.chat_endpoint}/{task_id}/stop", headers=endpoint.headers, json={"user": user})
+            logger.info(f"已请求停止生成: task_id={task_id}, status_code={response.status_code}, text={response.text}")
+            return response.status_code == 200
+        except httpx.HTTPError as exc:
+            llm_exception(exc)
+            return False
+
+    def hedgeable(self, params):
+        """已有会话的请求不对冲：会话固定在同一后端，对冲会向同一会话重复提交问题，留下重复的用户消息"""
+        return not params.get("conversation_id")
+
+    def abandon_stream(self, params, meta):
+        if meta.get("task_id"):
+            self.spawn(self.stop_generation(meta["task_id"], params["user"], meta.get("endpoint")))
+
+    def settle_hedge(self, params, kwargs, winner_meta, loser_meta):
+        """停止落败请求在Dify中的生成；两路都已创建新会话时，以胜出请求的会话为准"""
+        if loser_meta.get("task_id"):
+            self.spawn(self.stop_generation(loser_meta["task_id"], params["user"], loser_meta.get("endpoint")))
+        session_store = kwargs.get("session_store")
+        if session_store is not None and not params.get("conversation_id") and loser_meta.get("conversation_id") and winner_meta.get("conversation_id"):
+            self.save_conversation_id(params["user"], session_store, kwargs.get("session_key"), winner_meta["conversation_id"])
+
+    async def _track_conversation(self, gen, meta, user_name, session_store, session_key, endpoint):
+        """透传流式内容，首次解析到conversation_id时立即保存到会话，并把会话固定到当前后端"""
+        saved = False
+        try:
+            async for content in gen:
+                if not saved and meta.get("conversation_id"):
+                    self.endpoints.bind(meta["conversation_id"], endpoint)
+                    self.save_conversation_id(user_name, session_store, session_key, meta["conversation_id"])
+                    saved = True
+                yield content
+        finally:
+            await gen.aclose()
+
+    @staticmethod
+    def save_conversation_id(user_name, session_store, session_key, new_conversations_id):
+        old_conversations_id = session_store.get(session_key).get("conversation_id")
+        session_store.update(session_key, conversation_id=new_conversations_id, user_name=user_name)
+        logger.info(f'将```{user_name}```的conversations id从```{old_conversations_id}```更新为```{new_conversations_id}```')
+
+    async def update_conversation_id(self, user_name, session_store, session_key, conv_params, endpoint):
+        """回退方案：在创建会话的后端查询会话列表并取最新的会话，并发新建会话时可能取错"""
+        get_response = await endpoint.client.get(self.conv_endpoint, params=conv_params, headers=endpoint.headers)
         conv_data = get_response.json()
         conv_list = conv_data.get("data", [])
         logger.debug(f"获取到的conversations id列表: {conv_list}")
-        new_conversations_id = conv_list[0]["id"]
-        old_conversations_id = user_info[user_name].get("conversation_id")
-        user_info[user_name]["conversation_id"] = new_conversations_id
-        logger.info(f'已获取到conversations id列表，将```{user_name}```的conversations id从```{old_conversations_id}```更新为```{new_conversations_id}```')
+        logger.warning(f"响应中未携带conversation_id，已回退为查询会话列表: user={user_name}")
+        self.endpoints.bind(conv_list[0]["id"], endpoint)
+        self.save_conversation_id(user_name, session_store, session_key, conv_list[0]["id"])
 
 class FastGPTClient(BaseLLMClient):
     # 适配FastGPT特有逻辑
@@ -264,17 +615,15 @@ class FastGPTClient(BaseLLMClient):
                 yield content  # 逐块传递数据流
 
     @staticmethod
-    async def parse_json_response(response, response_data):
-        content, answer, response_data = await super().parse_json_response(response, response_data)
+    async def parse_json_response(response, response_data, meta=None):
+        content, answer, response_data = await BaseLLMClient.parse_json_response(response, response_data, meta)
         content = content.replace('0:', '', 1).replace('1:', '', 1).strip()
         answer = content
         return content, answer, response_data
 
     @staticmethod
-    async def parse_event_stream(line, answer, response_data):
-        content, answer, response_data = await super().parse_event_stream(line, answer, response_data)
-        answer = answer.replace('0:', '', 1).replace('1:', '', 1).strip()
-        return content, answer, response_data
+    def finalize_answer(answer):
+        return answer.replace('0:', '', 1).replace('1:', '', 1).strip()
 
 
 
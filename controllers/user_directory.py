@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from utils.cache import AsyncTTLCache
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class UserDirectory:
+    """按open_id缓存飞书用户名，支持过期后台刷新、并发未命中合并和按群批量预取"""
+    batch_size = 50  # contact.v3.user.batch 单次最多支持50个用户
+
+    def __init__(self, feishu_client, ttl=3600, max_size=5000, stale_ttl=86400, chat_prefetch_interval=3600):
+        self.feishu_client = feishu_client
+        self.cache = AsyncTTLCache(feishu_client.get_user_name, ttl, max_size, stale_ttl)
+        self.chat_prefetch_interval = chat_prefetch_interval
+        self._chat_prefetched_at = {}  # chat_id -> 上次预取时间
+        self._tasks = set()  # 持有后台任务引用，避免被回收
+
+    async def get_name(self, open_id):
+        return await self.cache.get(open_id)
+
+    async def prefetch(self, open_ids):
+        """通过批量接口预取尚未缓存的用户名"""
+        missing = [open_id for open_id in dict.fromkeys(open_ids) if self.cache.peek(open_id) is None]
+        for i in range(0, len(missing), self.batch_size):
+            names = await self.feishu_client.batch_get_user_names(missing[i:i + self.batch_size])
+            for open_id, name in names.items():
+                self.cache.set(open_id, name)
+        if missing:
+            logger.info(f"已批量预取 {len(missing)} 个用户名, 缓存统计: {self.cache.stats}")
+
+    async def prefetch_chat(self, chat_id):
+        """预取整个群的成员用户名，同一个群在间隔内只预取一次"""
+        now = time.monotonic()
+        if now - self._chat_prefetched_at.get(chat_id, -self.chat_prefetch_interval) < self.chat_prefetch_interval:
+            return
+        self._chat_prefetched_at[chat_id] = now
+        try:
+            member_ids = await self.feishu_client.get_chat_member_ids(chat_id)
+            await self.prefetch(member_ids)
+        except Exception as err:
+            logger.warning(f"群成员预取失败: chat_id={chat_id}, err={err}")
+
+    def schedule_prefetch_chat(self, chat_id):
+        task = asyncio.ensure_future(self.prefetch_chat(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,56 @@
+import json
+
+import httpx
+
+from utils.logger import get_logger
+from utils.token_cache import TokenCache
+
+logger = get_logger()
+
+
+class WechatApi:
+    """公众号服务端API：缓存access_token（提前后台刷新，并发共享同一次刷新），发送客服消息"""
+    token_endpoint = "/cgi-bin/token"
+    custom_send_endpoint = "/cgi-bin/message/custom/send"
+    invalid_token_codes = {40001, 40014, 42001}  # access_token无效或已过期
+
+    def __init__(self, app_id, app_secret, base_url="https://api.weixin.qq.com", timeout=10, refresh_ahead=300, min_valid=30):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(timeout))
+        self.token_cache = TokenCache(self._fetch_token, "公众号access_token", refresh_ahead, min_valid)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def get_access_token(self) -> str:
+        return await self.token_cache.get()
+
+    def invalidate(self):
+        self.token_cache.invalidate()
+
+    async def send_text(self, open_id, content):
+        """发送客服文本消息，token失效时刷新后重试一次"""
+        body = json.dumps({"touser": open_id, "msgtype": "text", "text": {"content": content}}, ensure_ascii=False).encode('utf-8')
+        for attempt in range(2):
+            token = await self.get_access_token()
+            response = await self.client.post(self.custom_send_endpoint, params={"access_token": token}, content=body,
+                                              headers={"Content-Type": "application/json"})
+            result = response.json()
+            errcode = result.get("errcode", 0)
+            if errcode == 0:
+                logger.info(f"客服消息发送成功: open_id={open_id}")
+                return result
+            if errcode in self.invalid_token_codes and attempt == 0:
+                logger.warning(f"access_token已失效，刷新后重试: {result}")
+                self.invalidate()
+                continue
+            raise RuntimeError(f"发送客服消息失败: {result}")
+
+    async def _fetch_token(self):
+        response = await self.client.get(self.token_endpoint, params={"grant_type": "client_credential", "appid": self.app_id,
+                                                                      "secret": self.app_secret})
+        result = response.json()
+        if response.status_code != 200 or not result.get('access_token'):
+            raise RuntimeError(f"获取access_token失败: {result}")
+        return result['access_token'], result.get('expires_in', 7200)
@@ -1,4 +1,4 @@
-import copy
+import asyncio
 import hashlib
 import time
 
@@ -7,25 +7,59 @@ from fastapi.responses import Response
 
 from configs.settings import settings
 from controllers.llm_client import DifyClient
+from controllers.wechat_api import WechatApi
 from utils.logger import get_logger
+from utils.metrics import registry
 from utils.parse import generate_reply
+from utils.response_cache import ResponseCache
 
 logger = get_logger()
 
 
 class WechatMp:
     def __init__(self):
-        base_url = settings.config.llm_models[settings.mp_model_name].base_url
-        chat_endpoint = settings.config.llm_models[settings.mp_model_name].chat_endpoint
-        api_key = settings.dify_mp_secret or settings.config.llm_models[settings.mp_model_name].api_key
-        concurrency_limit = settings.config.llm_models[settings.mp_model_name].concurrency_limit
-        timeout = settings.config.llm_models[settings.mp_model_name].timeout
+        config = settings.config  # 同一份配置快照
+        model_config = config.llm_models[settings.mp_model_name]
+        base_url = model_config.base_url
+        chat_endpoint = model_config.chat_endpoint
+        api_key = settings.dify_mp_secret or model_config.api_key
+        concurrency_limit = model_config.concurrency_limit
+        timeout = model_config.timeout
+        cache_ttl = model_config.cache_ttl
         self.model_name = settings.mp_model_name
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
-        self.dify_mp_client = DifyClient(base_url, chat_endpoint, '', headers, concurrency_limit, timeout)
+        # 公众号问答多为重复的无状态问题，开启cache_ttl后相同问题直接返回缓存答案
+        cache_config = config.response_cache
+        response_cache = ResponseCache(cache_config.max_entries, cache_config.max_bytes, cache_config.db_path or None,
+                                       cache_config.replay_chunk_chars) if cache_ttl > 0 else None
+        self.dify_mp_client = DifyClient(base_url, chat_endpoint, '', headers, concurrency_limit, timeout,
+                                         response_cache=response_cache, cache_ttl=cache_ttl, endpoints=model_config.endpoints,
+                                         lb_strategy=model_config.lb_strategy, eject_failures=model_config.eject_failures,
+                                         eject_seconds=model_config.eject_seconds, first_token_timeout=model_config.first_token_timeout,
+                                         hedge_budget=model_config.hedge_budget, adaptive_limit=model_config.adaptive_limit,
+                                         circuit_breaker=model_config.circuit_breaker, fallback_answer=model_config.fallback_answer)
+        mp_config = config.wechat_mp
+        self.reply_deadline = mp_config.reply_deadline  # 被动回复截止时间，需小于微信的5秒超时
+        self.msg_ttl = mp_config.msg_ttl  # 回答完成后保留MsgId的时长，用于吸收迟到的重试
+        # 未配置公众号AppID/AppSecret时无法发送客服消息，只能等待完整回答
+        self.wechat_api = WechatApi(settings.wechat_mp_app_id, settings.wechat_mp_app_secret, mp_config.api_base_url,
+                                    mp_config.api_timeout) if settings.wechat_mp_app_id and settings.wechat_mp_app_secret else None
+        self._inflight = {}  # MsgId -> 生成回答的Task
+        self._async_replies = set()  # 已转为客服消息发送的MsgId
+        self._deliveries = set()
+        self.dify_mp_client.register_metrics("wechat_mp")
+        registry.gauge("wechat_mp_inflight_replies", "公众号正在生成中的回答数", lambda: len(self._inflight))
+        settings.config_cache.subscribe(self.apply_config)
+
+    def apply_config(self, config):
+        """配置文件热加载后更新超时等参数，请求参数在每次请求时从配置快照读取"""
+        model_config = config.llm_models[self.model_name]
+        self.dify_mp_client.reconfigure(model_config)
+        self.reply_deadline = config.wechat_mp.reply_deadline
+        self.msg_ttl = config.wechat_mp.msg_ttl
 
     @staticmethod
     def verify(signature, timestamp, nonce, echostr):
@@ -49,24 +83,64 @@ class WechatMp:
 
 
     async def chat(self, message):
-        """微信消息处理核心逻辑"""
+        """微信消息处理核心逻辑：微信5秒内未收到回复会用同一MsgId重试，重试共享同一次生成；
+        截止时间内未生成完则先回复success，生成后通过客服消息发送"""
+        msg_id = message.get('MsgId') or f"{message.get('FromUserName')}:{message.get('CreateTime')}"
+        task = self._inflight.get(msg_id)
+        if task is None:
+            task = asyncio.ensure_future(self.answer(message))
+            self._inflight[msg_id] = task
+            task.add_done_callback(lambda t: asyncio.get_running_loop().call_later(self.msg_ttl, self._forget, msg_id))
+        else:
+            logger.info(f'微信重试消息，共享进行中的回答: MsgId={msg_id}')
+        if msg_id in self._async_replies:
+            return Response(content="success", media_type="text/plain")
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.reply_deadline if self.wechat_api else None)
+            if done and msg_id not in self._async_replies:
+                # 返回前端
+                response_xml = generate_reply(message['FromUserName'], message['ToUserName'], int(time.time()), task.result())
+                return Response(content=response_xml, media_type="application/xml")
+        except Exception as error:
+            logger.error(f'LLM response failed with error: {error}. ')
+            raise
+        if msg_id not in self._async_replies:
+            logger.info(f'回答未在{self.reply_deadline}秒内生成，改用客服消息发送: MsgId={msg_id}')
+            self._async_replies.add(msg_id)
+            delivery = asyncio.ensure_future(self.deliver(message['FromUserName'], task))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+        return Response(content="success", media_type="text/plain")
+
+    async def answer(self, message):
         # 获取配置
-        params = copy.deepcopy(settings.config.llm_param[self.model_name])
+        params = settings.config.llm_param[self.model_name].model_dump()
         logger.info(f'Dify MP Request message: {message}')  # 查看消息解析是否正确
         # 回复文本消息示例
         query = message['Content']
-        params.query = query
+        params["query"] = query
+        response_content = await self.dify_mp_client.get_completion(params)
+        # from controllers.llm_client import get_completion
+        # response_content = await get_completion(self.base_url, self.chat_endpoint, self.headers, params, concurrency_limit=5, timeout=30)
+        logger.info(f'Dify MP Response message: {response_content}')  # 查看消息解析是否正确
+        return response_content
+
+    async def deliver(self, open_id, task):
+        """等待回答生成后通过客服消息接口发送"""
         try:
-            response_content = await self.dify_mp_client.get_completion(params)
-            # from controllers.llm_client import get_completion
-            # response_content = await get_completion(self.base_url, self.chat_endpoint, self.headers, params, concurrency_limit=5, timeout=30)
-            logger.info(f'Dify MP Response message: {response_content}')  # 查看消息解析是否正确
-            # 返回前端
-            response_xml = generate_reply(message['FromUserName'], message['ToUserName'], int(time.time()), response_content)
-            return Response(content=response_xml, media_type="application/xml")
+            await self.wechat_api.send_text(open_id, await task)
         except Exception as error:
-            logger.error(f'LLM response failed with error: {error}. ')
-            raise
+            logger.error(f'客服消息发送失败: open_id={open_id}, err: {error}')
+
+    def _forget(self, msg_id):
+        self._inflight.pop(msg_id, None)
+        self._async_replies.discard(msg_id)
+
+    async def close(self):
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        await self.dify_mp_client.close()
+        if self.wechat_api is not None:
+            await self.wechat_api.close()
 
 
     # async def test():
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+def sqlite_path_from_url(database_url):
+    """将 sqlite:///./app.db 形式的数据库URL转换为文件路径"""
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        raise ValueError(f"Unsupported database_url: {database_url}, only sqlite is supported.")
+    return database_url[len(prefix):]
+
+
+class SessionStore:
+    """会话存储：内存LRU前端 + SQLite后写（write-behind），按TTL过期，批量提交"""
+
+    def __init__(self, database_url, ttl=604800, max_size=10000, flush_interval=1.0, flush_batch=100):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._cache = OrderedDict()  # key -> (data, updated_at)
+        self._dirty = {}  # key -> (data, updated_at)，data为None表示删除
+        self._flush_task = None
+        db_path = sqlite_path_from_url(database_url)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._db.commit()
+
+    @staticmethod
+    def session_key(chat_type, open_id, chat_id):
+        """单聊按open_id区分会话，群聊按群内的每个用户区分"""
+        return open_id if chat_type == "p2p" else f"{chat_id}:{open_id}"
+
+    def get(self, key):
+        """读取会话数据，不存在或已过期返回空字典"""
+        now = time.time()
+        item = self._cache.get(key)
+        if item is None:
+            row = self._db.execute("SELECT data, updated_at FROM sessions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return {}
+            item = (json.loads(row[0]), row[1])
+            self._put(key, item)
+        data, updated_at = item
+        if now - updated_at > self.ttl:
+            self.delete(key)
+            return {}
+        self._cache.move_to_end(key)
+        return dict(data)
+
+    def update(self, key, **fields):
+        data = self.get(key)
+        data.update(fields)
+        item = (data, time.time())
+        self._put(key, item)
+        self._mark_dirty(key, item)
+        return data
+
+    def delete(self, key):
+        self._cache.pop(key, None)
+        self._mark_dirty(key, (None, time.time()))
+
+    def start(self, loop):
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_loop())
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+        self._db.close()
+
+    def flush(self):
+        """把脏数据在一个事务内批量写入SQLite，并清理过期会话"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [(key, json.dumps(data, ensure_ascii=False), updated_at) for key, (data, updated_at) in dirty.items() if data is not None]
+        deletes = [(key,) for key, (data, _) in dirty.items() if data is None]
+        try:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO sessions (key, data, updated_at) VALUES (?, ?, ?)", upserts)
+                self._db.executemany("DELETE FROM sessions WHERE key = ?", deletes)
+                self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            logger.debug(f"会话存储已提交: upserts={len(upserts)}, deletes={len(deletes)}")
+        except sqlite3.Error as err:
+            logger.error(f"会话存储提交失败: {err}")
+            for key, item in dirty.items():
+                self._dirty.setdefault(key, item)  # 保留未写入的数据，下次重试
+
+    def _put(self, key, item):
+        self._cache[key] = item
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            old_key, _ = self._cache.popitem(last=False)
+            if old_key in self._dirty:  # 被淘汰的脏数据需先落盘
+                self.flush()
+
+    def _mark_dirty(self, key, item):
+        self._dirty[key] = item
+        if len(self._dirty) >= self.flush_batch:
+            self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
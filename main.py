@@ -1,6 +1,7 @@
 import asyncio
 import signal
 
+from configs.settings import settings
 from models.exception_model import SigIntException, SigTermException, ShutdownSignalException
 from controllers.feishu_robot import FeishuRobot
 from controllers.lark_client import loop
@@ -10,7 +11,8 @@ from utils.status import async_keep_alive, graceful_shutdown
 
 
 # 初始化日志
-setup_logger()
+log_config = settings.config.logging
+setup_logger(enqueue=log_config.enqueue, payload_sample_rate=log_config.payload_sample_rate, payload_max_chars=log_config.payload_max_chars)
 logger = get_logger()
 # 注册信号处理
 signal.signal(signal.SIGINT, graceful_shutdown)  # Ctrl+C
@@ -1,16 +1,51 @@
 from typing import Dict, Any, List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 
-class LLMModelsConfig(BaseModel):
+class FrozenModel(BaseModel):
+    """配置快照只读，热加载时整体替换而不是原地修改"""
+    model_config = ConfigDict(frozen=True)
+
+
+class EndpointConfig(FrozenModel):
+    base_url: str
+    weight: float = Field(1.0, gt=0)
+    api_key: Optional[str] = None  # 为空时使用模型的api_key
+
+class AdaptiveLimitConfig(FrozenModel):
+    max_concurrency: int = 0  # 自适应并发上限的最大值，0表示固定为concurrency_limit
+    min_concurrency: int = 1
+    latency_threshold: float = 3.0  # 首包时延超过该值视为过载
+    max_wait: float = 30.0  # 排队超过该时长拒绝并返回降级回答
+
+class CircuitBreakerConfig(FrozenModel):
+    error_threshold: float = 0.5
+    min_requests: int = 20
+    window: int = 30
+    open_seconds: float = 30.0
+
+class ResilienceConfig(FrozenModel):
+    """各模型通用的缓存、负载均衡、对冲、限流和熔断参数，未配置时使用默认值"""
+    cache_ttl: int = 0  # 应答缓存时长（秒），0表示不缓存
+    endpoints: List[EndpointConfig] = []  # 多个后端副本时配置，为空则只使用base_url
+    lb_strategy: str = "least_outstanding"  # least_outstanding 或 ewma
+    eject_failures: int = 3
+    eject_seconds: float = 30.0
+    first_token_timeout: float = 0  # 首个token超时后发送对冲请求（秒），0表示不对冲
+    hedge_budget: float = 0.1  # 对冲请求占总请求的比例上限
+    adaptive_limit: AdaptiveLimitConfig = AdaptiveLimitConfig()
+    circuit_breaker: CircuitBreakerConfig = CircuitBreakerConfig()
+    fallback_answer: str = "当前咨询人数较多，请稍后重试"  # 熔断或排队超时时直接返回
+
+class LLMModelsConfig(ResilienceConfig):
     base_url: str
     chat_endpoint: str = ""
     api_key: Optional[str] = None
     concurrency_limit: int
     timeout: int
-    
-class DifyModelsConfig(BaseModel):
+
+class DifyModelsConfig(ResilienceConfig):
     base_url: str
     chat_endpoint: str = ""
     conv_endpoint: str = ""
@@ -20,7 +55,7 @@ class DifyModelsConfig(BaseModel):
     concurrency_limit: int
     timeout: int
 
-class LLMParamConfig(BaseModel):
+class LLMParamConfig(FrozenModel):
     model: str
     messages: List[Dict[str, str]] = []
     stream: bool = False
@@ -31,7 +66,7 @@ class LLMParamConfig(BaseModel):
     inputs: Dict[str, Any] = {}
     conversation_id: Optional[str] = None
 
-class DifyParamConfig(BaseModel):
+class DifyParamConfig(FrozenModel):
     model: str
     query: str = ""
     response_mode: str
@@ -41,8 +76,81 @@ class DifyParamConfig(BaseModel):
     messages: List[Dict[str, str]] = []
     stream: bool = False
 
-class AppConfig(BaseModel):
+class FeishuConfig(FrozenModel):
+    concurrency_limit: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: int = 30
+    timeout: int = 10
+    card_flush_interval_ms: int = 150
+    card_flush_chars: int = 200
+    dedupe_ttl: int = 3600
+    dedupe_max_size: int = 10000
+    dedupe_db_path: str = ""
+    user_cache_ttl: int = 3600
+    user_cache_max_size: int = 5000
+    user_cache_stale_ttl: int = 86400
+    chat_prefetch_interval: int = 3600
+    file_spool_max_size: int = 8388608
+    file_chunk_size: int = 65536
+    file_byte_budget: int = 134217728
+    queue_size: int = 100
+    worker_count: int = 30
+    card_pool_size: int = 10
+    card_pool_max_age: int = Field(480, gt=0, le=480)  # 飞书约10分钟后关闭卡片的流式模式，需留出生成回答的时间
+    card_pool_refill_interval: float = 5.0
+    api_rate_limits: Dict[str, float] = {"im.messages": 50, "cardkit.cards": 50, "contact.users": 20}  # 按接口族限流（次/秒）
+    api_default_rate: float = 50
+    card_update_rate: float = 10  # 单张卡片每秒更新次数
+    api_retry_base_delay: float = 0.2
+    api_retry_max_delay: float = 5.0
+
+class SchedulerConfig(FrozenModel):
+    p2p_weight: float = Field(2.0, gt=0)
+    group_weight: float = Field(1.0, gt=0)
+    vip_weight: float = Field(4.0, gt=0)
+    vip_open_ids: List[str] = []
+    user_inflight_limit: int = 2
+    quantum: float = Field(1.0, gt=0)
+    max_wait: int = 60
+
+class SessionConfig(FrozenModel):
+    ttl: int = 604800
+    max_size: int = 10000
+    flush_interval: float = 1.0
+    flush_batch: int = 100
+
+class WechatMpConfig(FrozenModel):
+    reply_deadline: float = 4.5
+    msg_ttl: int = 60
+    api_base_url: str = "https://api.weixin.qq.com"
+    api_timeout: int = 10
+
+class LoggingConfig(FrozenModel):
+    enqueue: bool = True
+    payload_sample_rate: float = 0.1
+    payload_max_chars: int = 1000
+
+class MonitorConfig(FrozenModel):
+    interval: float = 1.0  # 系统状态采样周期（秒）
+    gpu: bool = True  # 是否探测GPU，未安装GPUtil或没有nvidia-smi时自动关闭
+    gpu_interval: float = 10.0  # GPU探测需启动nvidia-smi子进程，单独设置较长的周期
+    gpu_idle: float = 60.0  # 超过该时长无人查看监控页时暂停GPU探测
+
+class ResponseCacheConfig(FrozenModel):
+    max_entries: int = 1000
+    max_bytes: int = 16777216
+    db_path: str = ""
+    replay_chunk_chars: int = 20
+
+class AppConfig(FrozenModel):
     # 字典形式，键是模型名称
     llm_models: Dict[str, Union[LLMModelsConfig, DifyModelsConfig]]
     llm_param: Dict[str, Union[LLMParamConfig, DifyParamConfig]]
+    feishu: FeishuConfig = FeishuConfig()
+    session: SessionConfig = SessionConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    response_cache: ResponseCacheConfig = ResponseCacheConfig()
+    wechat_mp: WechatMpConfig = WechatMpConfig()
+    logging: LoggingConfig = LoggingConfig()
+    monitor: MonitorConfig = MonitorConfig()
 
@@ -7,3 +7,13 @@ class SigIntException(ShutdownSignalException):
 
 class SigTermException(ShutdownSignalException):
     pass
+
+class LLMUnavailableException(Exception):
+    """LLM后端暂不可用，调用方应直接返回降级回答"""
+    pass
+
+class CircuitOpenException(LLMUnavailableException):
+    pass
+
+class ConcurrencyLimitException(LLMUnavailableException):
+    pass
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from routes.v1.endpoints import health, wechat_mp, feishu_robot
+from routes.v1.endpoints import health, wechat_mp, feishu_robot, metrics, monitor
 
 api_router = APIRouter()
 
@@ -8,3 +8,5 @@ api_router = APIRouter()
 api_router.include_router(health.router, prefix="/health", tags=["health"])
 api_router.include_router(wechat_mp.router, prefix="/wechat_mp", tags=["wechat_mp"])
 api_router.include_router(feishu_robot.router, prefix="/feishu_robot", tags=["feishu_robot"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
+api_router.include_router(monitor.router, prefix="/monitor", tags=["monitor"])
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from utils.metrics import registry
+
+router = APIRouter()
+
+
+@router.get("")
+async def metrics():
+    """Prometheus文本格式的指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
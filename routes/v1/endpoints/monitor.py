@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from configs.settings import settings
+from utils.status import system_sampler
+
+router = APIRouter()
+
+
+def ensure_sampler():
+    """未随服务启动时，在首次访问时启动后台采样"""
+    if not system_sampler.running:
+        monitor_config = settings.config.monitor
+        system_sampler.reconfigure(monitor_config.interval, monitor_config.gpu, monitor_config.gpu_interval, monitor_config.gpu_idle)
+        system_sampler.start()
+
+
+@router.get("")
+async def monitor():
+    """系统状态快照"""
+    ensure_sampler()
+    return Response(system_sampler.read(), media_type="application/json")
+
+
+@router.get("/stream")
+async def monitor_stream(request: Request):
+    """以SSE推送每次采样后的系统状态"""
+    ensure_sampler()
+
+    async def events():
+        async for payload in system_sampler.updates():
+            if await request.is_disconnected():
+                break
+            yield f"data: {payload}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,73 @@
+import asyncio
+import io
+import json
+import time
+
+from controllers.llm_client import BaseLLMClient, DifyClient
+from utils.logger import get_logger, payload_config
+from utils.sse import SSEDecoder
+
+# 对比改造前后每条消息的日志CPU开销：模拟一次Dify流式回答（约400个SSE事件）
+logger = get_logger()
+messages = 200
+params = {"model": "dify", "query": "你好" * 200, "response_mode": "streaming", "user": "user-123", "conversation_id": "",
+          "inputs": {"doc": "x" * 2000}, "messages": [], "stream": True}
+dify_client = DifyClient("http://dify.local", "/v1/chat-messages", "", {}, 10, 30)
+lines = []
+for i in range(400):
+    lines.append("data: " + json.dumps({"event": "message", "task_id": "t", "message_id": "m", "conversation_id": "c",
+                                        "answer": f"第{i}段回答内容，"}, ensure_ascii=False))
+    lines.append("")
+payload = "\n".join(lines).encode("utf-8")
+
+
+async def legacy_parse_event_stream(line, answer, response_data):
+    """改造前：逐行拼接response_data"""
+    response_data += line + '\n'
+    line = line.strip().replace('data: ', '', 1)
+    if not line or line == "[DONE]" or not line.startswith("{"):
+        return None, answer, response_data
+    data = json.loads(line)
+    if content := data.get('answer', ''):
+        answer += content
+    return content, answer, response_data
+
+
+async def legacy_message():
+    logger.info(f"LLM request params: ---\n{params}\n---")
+    answer, response_data = '', "streaming...\n"
+    for line in lines:
+        content, answer, response_data = await legacy_parse_event_stream(line, answer, response_data)
+    logger.info(f'LLM response data[:500]: ===\n{response_data[:500]}\n===')
+    logger.info(f'LLM answer: ===\n{answer}\n===')
+
+
+async def current_message():
+    BaseLLMClient.log_request(params)
+    decoder, answer_parts, meta = SSEDecoder(), [], {}
+    for event in decoder.feed(payload):
+        answer_parts.append(dify_client.parse_sse_event(event, meta))
+    BaseLLMClient.log_response(''.join(answer_parts), decoder.render)
+
+
+async def measure(name, func):
+    started = time.process_time()
+    for _ in range(messages):
+        await func()
+    per_message = (time.process_time() - started) / messages * 1000
+    print(f"{name}: {per_message:.3f} ms CPU/消息")
+    return per_message
+
+
+async def main():
+    logger.remove()
+    logger.add(io.StringIO(), level="INFO", enqueue=True)  # 生产配置：INFO级别、后台线程写入
+    payload_config.update(sample_rate=0.1, max_chars=1000)
+    legacy = await measure("改造前", legacy_message)
+    current = await measure("改造后", current_message)
+    print(f"每条消息节省 {legacy - current:.3f} ms CPU ({(1 - current / legacy) * 100:.1f}%)")
+    await logger.complete()
+    await dify_client.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+import tracemalloc
+
+import httpx
+
+from controllers.llm_client import DifyClient
+from utils.logger import get_logger
+
+# 对比逐行解析(aiter_lines)与按字节分块增量解码SSE的吞吐(tokens/秒)和内存分配
+tokens = 2000
+chunk_size = 64  # 模拟网络分块，事件会被截断在分块边界
+events = []
+for i in range(tokens):
+    events.append("data: " + json.dumps({"event": "message", "task_id": "t", "message_id": "m", "conversation_id": "c",
+                                         "answer": f"第{i}个词"}, ensure_ascii=False) + "\n\n")
+events.append(": ping\n\n")
+events.append("data: " + json.dumps({"event": "message_end", "task_id": "t", "conversation_id": "c"}) + "\n\n")
+logger = get_logger()
+body = "".join(events).encode("utf-8")
+chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        for chunk in chunks:
+            yield chunk
+
+
+def make_response():
+    return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=ChunkedStream())
+
+
+async def legacy_parse(response):
+    """改造前：按行读取，逐行拼接response_data和answer"""
+    answer, response_data = '', "streaming...\n"
+    async for line in response.aiter_lines():
+        response_data += line + '\n'
+        line = line.strip().replace('data: ', '', 1)
+        if not line or line == "[DONE]" or not line.startswith("{"):
+            continue
+        data = json.loads(line)
+        if content := data.get('answer', ''):
+            answer += content
+    return answer
+
+
+async def current_parse(client, response):
+    return await client._default_parser(response, {})
+
+
+async def measure(name, parse):
+    rounds = 20
+    started = time.perf_counter()
+    for _ in range(rounds):
+        answer = await parse(make_response())
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    await parse(make_response())
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size for stat in snapshot.statistics("filename"))
+    print(f"{name}: {tokens * rounds / elapsed:,.0f} tokens/秒, 峰值内存 {peak / 1024:.1f} KiB, 残留分配 {allocated / 1024:.1f} KiB")
+    return answer
+
+
+async def main():
+    logger.remove()  # 只比较解析开销
+    client = DifyClient("http://dify.local", "/v1/chat-messages", "", {}, 10, 30)
+    legacy = await measure("改造前(aiter_lines)", legacy_parse)
+    current = await measure("改造后(SSEDecoder)", lambda response: current_parse(client, response))
+    assert legacy == current
+    await client.close()
+
+
+asyncio.run(main())
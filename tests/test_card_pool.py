@@ -0,0 +1,56 @@
+import asyncio
+
+from controllers.card_pool import CardPool
+from models.config_schemas import FeishuConfig
+
+
+class FakeFeishu:
+    """模拟创建卡片的飞书客户端"""
+
+    def __init__(self):
+        self.created = []
+
+    async def create_card(self):
+        card_id = f"card-{len(self.created)}"
+        self.created.append(card_id)
+        return card_id
+
+
+async def main():
+    feishu = FakeFeishu()
+    pool = CardPool(feishu, size=2, max_age=60, refill_interval=0.05)
+    pool.start(asyncio.get_running_loop())
+    await asyncio.sleep(0.1)
+
+    # 复用：池中的卡片直接取出，不再现场创建
+    card_id = await pool.acquire()
+    print(f"复用: {card_id}, 已创建: {feishu.created}, 指标: {pool.stats}")
+    assert card_id in ("card-0", "card-1") and pool.stats["hits"] == 1 and pool.stats["misses"] == 0
+
+    # 过期：超过max_age的卡片被丢弃，取到的是新创建的卡片
+    await asyncio.sleep(0.1)
+    pool._cards = type(pool._cards)((card, created_at - 61) for card, created_at in pool._cards)
+    stale = {card for card, _ in pool._cards}
+    card_id = await pool.acquire()
+    print(f"过期后: {card_id}, 丢弃: {sorted(stale)}, 指标: {pool.stats}")
+    assert card_id not in stale and pool.stats["expired"] == len(stale) and pool.stats["misses"] == 1
+    await pool.close()
+
+    # 卡片的流式模式约10分钟后关闭，超过上限的配置被拒绝
+    for max_age in (0, 86400):
+        try:
+            CardPool(feishu, max_age=max_age)
+        except ValueError as exc:
+            print(f"拒绝: {exc}")
+        else:
+            raise AssertionError(max_age)
+    try:
+        FeishuConfig(card_pool_max_age=86400)
+    except ValueError:
+        print("配置拒绝: card_pool_max_age=86400")
+    else:
+        raise AssertionError("card_pool_max_age")
+    assert FeishuConfig().card_pool_max_age < 600
+
+
+asyncio.run(main())
@@ -0,0 +1,45 @@
+import asyncio
+
+from configs.settings import settings
+from controllers.feishu_robot import FeishuRobot
+
+
+def with_model(config, **updates):
+    """复制配置快照并修改飞书所用模型的参数"""
+    model_name = settings.fs_model_name
+    model_config = config.llm_models[model_name].model_copy(update=updates)
+    return config.model_copy(update={"llm_models": {**config.llm_models, model_name: model_config}})
+
+
+async def main():
+    robot = FeishuRobot()
+    client = robot.dify_fs_client
+    config = settings.config
+    adaptive_limit = config.llm_models[settings.fs_model_name].adaptive_limit
+    print(f"初始: limiter={client.limiter.metrics}, scheduler_capacity={robot.scheduler.capacity}")
+
+    # 调低concurrency_limit：当前上限和调度容量立即跟随新值
+    robot.apply_config(with_model(config, concurrency_limit=3))
+    print(f"concurrency_limit=3: limiter={client.limiter.metrics}, max={client.limiter.max_limit}, scheduler_capacity={robot.scheduler.capacity}")
+    assert int(client.limiter.limit) == 3 and robot.scheduler.capacity == 3
+    assert client.limiter.max_limit == max(3, adaptive_limit.max_concurrency)
+
+    # 调高concurrency_limit
+    robot.apply_config(with_model(config, concurrency_limit=15))
+    print(f"concurrency_limit=15: limiter={client.limiter.metrics}, max={client.limiter.max_limit}, scheduler_capacity={robot.scheduler.capacity}")
+    assert int(client.limiter.limit) == 15 and robot.scheduler.capacity == 15
+    assert client.limiter.max_limit == max(15, adaptive_limit.max_concurrency)
+
+    # concurrency_limit未变化时保留自适应得到的上限，调度容量随之变化
+    client.limiter.record(False, 0.0)
+    adapted = int(client.limiter.limit)
+    robot.apply_config(with_model(config, concurrency_limit=15, timeout=60))
+    print(f"未变化: limiter={client.limiter.metrics}, scheduler_capacity={robot.scheduler.capacity}")
+    assert int(client.limiter.limit) == adapted < 15 and robot.scheduler.capacity == adapted
+
+    await client.close()
+    robot.session_store.close()
+    robot.message_deduper.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,56 @@
+import asyncio
+
+from controllers.fair_scheduler import FairScheduler
+
+
+async def main():
+    scheduler = FairScheduler(capacity=1, user_inflight_limit=1, max_wait=5)
+    waiting = asyncio.Event()
+
+    async def waiter():
+        waiting.set()
+        async with scheduler.slot("flow-u2", "u2"):
+            pass
+
+    # u1占用唯一名额，u2排队；u2超时（等待的future被取消）与u1归还名额发生在同一轮事件循环
+    async with scheduler.slot("flow-u1", "u1"):
+        task = asyncio.create_task(waiter())
+        await waiting.wait()
+        await asyncio.sleep(0)
+        _, future = scheduler._flows["flow-u2"].waiters[0]
+        future.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(f"取消与归还同时发生后: {scheduler.metrics}, user_inflight={dict(scheduler._user_inflight)}")
+    assert task.cancelled()
+    assert scheduler.metrics["inflight"] == 0 and not scheduler._user_inflight
+
+    # 名额没有泄漏，之后的请求仍能获得调度
+    async with scheduler.slot("flow-u3", "u3"):
+        pass
+    await asyncio.wait_for(asyncio.gather(*(use_slot(scheduler, f"u{index}") for index in range(5))), 1)
+    print(f"之后的调度: {scheduler.metrics}")
+    assert scheduler.metrics["inflight"] == 0
+
+    # 权重或quantum不为正时拒绝，而不是卡死事件循环
+    for args in ({"quantum": 0}, {"quantum": -1}):
+        try:
+            FairScheduler(**args)
+        except ValueError as exc:
+            print(f"拒绝: {exc}")
+        else:
+            raise AssertionError(args)
+    try:
+        async with scheduler.slot("flow-zero", "u0", weight=0):
+            pass
+    except ValueError as exc:
+        print(f"拒绝: {exc}")
+    else:
+        raise AssertionError("weight=0")
+
+
+async def use_slot(scheduler, user_key):
+    async with scheduler.slot(f"flow-{user_key}", user_key):
+        await asyncio.sleep(0.01)
+
+
+asyncio.run(main())
@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+
+from utils.spool import ByteBudget, spool_response
+
+CHUNK = 64 * 1024
+
+
+async def chunked_body(total):
+    """不带Content-Length的分块响应体"""
+    sent = 0
+    while sent < total:
+        size = min(CHUNK, total - sent)
+        sent += size
+        yield b"x" * size
+
+
+def make_client(total):
+    def handler(request):
+        return httpx.Response(200, content=chunked_body(total))
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def main():
+    budget = ByteBudget(4 * 1024 * 1024)
+    total = 3 * 1024 * 1024
+
+    # 分块响应超过预占额度后追加预算，占用与实际大小一致
+    async with make_client(total) as client:
+        async with client.stream("GET", "http://test/file") as response:
+            assert "Content-Length" not in response.headers
+            reserved = await budget.acquire(CHUNK)
+            spool, reserved = await spool_response(response, CHUNK, CHUNK, budget, reserved)
+    size = spool.seek(0, 2)
+    print(f"写入: {size}, 预占: {reserved}, 预算占用: {budget.in_use}")
+    assert size == total and reserved >= total and budget.in_use == reserved
+    spool.close()
+    await budget.release(reserved)
+    assert budget.in_use == 0
+
+    # 超过总预算的文件独占全部预算，不会卡死
+    async with make_client(6 * 1024 * 1024) as client:
+        async with client.stream("GET", "http://test/file") as response:
+            reserved = await budget.acquire(CHUNK)
+            spool, reserved = await spool_response(response, CHUNK, CHUNK, budget, reserved)
+    print(f"超大文件预占: {reserved}, 预算占用: {budget.in_use}")
+    assert reserved == budget.capacity == budget.in_use
+    spool.close()
+    await budget.release(reserved)
+
+    # 追加预算时等待其他任务释放，期间让出已占用部分，两个任务不会互相卡死
+    async def download():
+        async with make_client(total) as client:
+            async with client.stream("GET", "http://test/file") as response:
+                reserved = await budget.acquire(CHUNK)
+                spool, reserved = await spool_response(response, CHUNK, CHUNK, budget, reserved)
+        await asyncio.sleep(0.01)
+        spool.close()
+        await budget.release(reserved)
+        return reserved
+
+    results = await asyncio.wait_for(asyncio.gather(download(), download()), 5)
+    print(f"并发下载预占: {results}, 预算占用: {budget.in_use}")
+    assert budget.in_use == 0
+
+    # 下载中途失败时追加的额度由spool_response归还，调用方只释放最初预占的部分
+    async def broken_body():
+        yield b"x" * (2 * CHUNK)
+        raise httpx.ReadError("断开")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=broken_body()))) as client:
+        async with client.stream("GET", "http://test/file") as response:
+            reserved = await budget.acquire(CHUNK)
+            try:
+                await spool_response(response, CHUNK, CHUNK, budget, reserved)
+            except httpx.ReadError:
+                await budget.release(reserved)
+    print(f"失败后预算占用: {budget.in_use}")
+    assert budget.in_use == 0
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from controllers.wechat_api import WechatApi
+from controllers.wechat_mp import WechatMp
+
+# 本地模拟的微信服务端：签发access_token并记录收到的客服消息
+mock_host, mock_port = "127.0.0.1", 18080
+received = []
+token_requests = []
+
+
+class MockWechatHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/cgi-bin/token":
+            token_requests.append(parse_qs(url.query))
+            self._reply({"access_token": f"token-{len(token_requests)}", "expires_in": 7200})
+        else:
+            self._reply({"errcode": 404, "errmsg": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if url.path == "/cgi-bin/message/custom/send":
+            received.append((parse_qs(url.query)["access_token"][0], body))
+            self._reply({"errcode": 0, "errmsg": "ok"})
+        else:
+            self._reply({"errcode": 404, "errmsg": "not found"})
+
+    def _reply(self, data):
+        content = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_message(msg_id, content):
+    return {"ToUserName": "gh_mp", "FromUserName": "o_user", "CreateTime": str(int(time.time())), "MsgType": "text",
+            "Content": content, "MsgId": msg_id}
+
+
+async def main():
+    server = ThreadingHTTPServer((mock_host, mock_port), MockWechatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    wechat_mp = WechatMp()
+    wechat_mp.wechat_api = WechatApi("wx_app_id", "wx_app_secret", f"http://{mock_host}:{mock_port}")
+    wechat_mp.reply_deadline = 0.5
+    completions = []
+
+    async def slow_completion(params, **kwargs):
+        completions.append(params["query"])
+        await asyncio.sleep(1 if params["query"] == "slow" else 0.1)
+        return f"answer to {params['query']}"
+
+    wechat_mp.dify_mp_client.get_completion = slow_completion
+
+    # 截止时间内完成：被动回复XML
+    response = await wechat_mp.chat(make_message("1001", "fast"))
+    print(response.media_type, response.body.decode("utf-8").strip()[:120])
+
+    # 模拟微信对同一MsgId的三次重试：只生成一次，超时回复success，之后通过客服消息发送
+    responses = await asyncio.gather(*(wechat_mp.chat(make_message("1002", "slow")) for _ in range(3)))
+    print([response.body.decode("utf-8") for response in responses])
+    await asyncio.sleep(1)
+    print(f"completions: {completions}")
+    print(f"token requests: {len(token_requests)}, custom messages: {received}")
+    assert completions == ["fast", "slow"]
+    assert [body["text"]["content"] for _, body in received] == ["answer to slow"]
+
+    await wechat_mp.close()
+    server.shutdown()
+
+
+asyncio.run(main())
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class AsyncTTLCache:
+    """带TTL的异步LRU缓存：同一key的并发未命中共享一次加载，过期后在宽限期内先返回旧值并后台刷新"""
+
+    def __init__(self, loader, ttl=3600, max_size=1024, stale_ttl=0):
+        self.loader = loader  # async (key) -> value，返回None表示不缓存
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl  # 过期后仍可返回旧值的时长（stale-while-revalidate）
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, expire_at)
+        self._inflight = {}  # key -> Task，正在进行的加载
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "stale_hits": self.stale_hits,
+                "evictions": self.evictions, "inflight": len(self._inflight)}
+
+    def peek(self, key):
+        """只读取未过期的缓存值，不触发加载"""
+        item = self._data.get(key)
+        if item is not None and item[1] > time.monotonic():
+            return item[0]
+        return None
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    async def get(self, key):
+        item = self._data.get(key)
+        if item is not None:
+            value, expire_at = item
+            now = time.monotonic()
+            self._data.move_to_end(key)
+            if now < expire_at:
+                self.hits += 1
+                return value
+            if now < expire_at + self.stale_ttl:
+                self.stale_hits += 1
+                self._load(key)  # 后台刷新，先返回旧值
+                return value
+        self.misses += 1
+        return await asyncio.shield(self._load(key))
+
+    def _load(self, key):
+        """返回该key正在进行的加载任务，不存在则新建（single-flight）"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._do_load(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_loaded(key, t))
+        return task
+
+    async def _do_load(self, key):
+        value = await self.loader(key)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def _on_loaded(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"缓存加载失败: key={key}, err={task.exception()}")
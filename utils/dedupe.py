@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class TTLDeduper:
+    """按插入顺序淘汰的TTL去重索引，O(1)检查并插入，可选SQLite持久化以便重启后仍能去重"""
+
+    def __init__(self, ttl=3600, max_size=10000, db_path=None, purge_interval=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.purge_interval = purge_interval  # 每插入多少条清理一次持久化中的过期记录
+        self.hits = 0
+        self.evictions = 0
+        self._ids = OrderedDict()  # key -> 过期时间戳，TTL固定，因此插入顺序即过期顺序
+        self._inserts = 0
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def __contains__(self, key):
+        expire_at = self._ids.get(key)
+        return expire_at is not None and expire_at > time.time()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def stats(self):
+        return {"size": len(self._ids), "hits": self.hits, "evictions": self.evictions}
+
+    def seen(self, key) -> bool:
+        """检查key是否已出现过；未出现则记录并返回False"""
+        now = time.time()
+        self._evict_expired(now)
+        if key in self._ids:
+            self.hits += 1
+            return True
+        expire_at = now + self.ttl
+        self._ids[key] = expire_at
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+            self.evictions += 1
+        if self._db is not None:
+            self._persist(key, expire_at, now)
+        return False
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _evict_expired(self, now):
+        while self._ids:
+            key, expire_at = next(iter(self._ids.items()))
+            if expire_at > now:
+                break
+            self._ids.popitem(last=False)
+            self.evictions += 1
+
+    def _open_db(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dedupe (key TEXT PRIMARY KEY, expire_at REAL NOT NULL)")
+        now = time.time()
+        self._db.execute("DELETE FROM dedupe WHERE expire_at <= ?", (now,))
+        rows = self._db.execute("SELECT key, expire_at FROM dedupe ORDER BY expire_at DESC LIMIT ?", (self.max_size,)).fetchall()
+        for key, expire_at in reversed(rows):
+            self._ids[key] = expire_at
+        logger.info(f"已从 {db_path} 恢复 {len(self._ids)} 条去重记录")
+
+    def _persist(self, key, expire_at, now):
+        try:
+            self._db.execute("INSERT OR REPLACE INTO dedupe (key, expire_at) VALUES (?, ?)", (key, expire_at))
+            self._inserts += 1
+            if self._inserts % self.purge_interval == 0:
+                self._db.execute("DELETE FROM dedupe WHERE expire_at <= ?", (now,))
+        except sqlite3.Error as err:
+            logger.warning(f"去重记录持久化失败: {err}")
@@ -3,8 +3,11 @@ logger封装
 """
 import logging
 import os
+import random
 import shutil
 import sys
+from collections import deque
+from contextvars import ContextVar
 from datetime import datetime
 
 from loguru import logger
@@ -47,9 +50,16 @@ def configure_logging():
     _logger.info("Logging configured successfully for 'xxx' _logger.")
     return _logger
 
-def setup_logger(log_type="console_file", log_file="logs/api.log", console_level="INFO", file_level="DEBUG"):
+# 载荷（请求参数、响应原文）日志：按请求采样，且只保留头尾
+payload_config = {"sample_rate": 0.1, "max_chars": 1000}
+_payload_sampled = ContextVar("payload_sampled", default=None)  # 当前请求是否被采样
+
+
+def setup_logger(log_type="console_file", log_file="logs/api.log", console_level="INFO", file_level="DEBUG", enqueue=True,
+                 payload_sample_rate=0.1, payload_max_chars=1000):
     # 获取数值级别，方便在过滤器中使用
     logger.remove()
+    payload_config.update(sample_rate=payload_sample_rate, max_chars=payload_max_chars)
     rename_file(log_file)
     console_level_no = logger.level(console_level).no
     file_level_no = logger.level(file_level).no
@@ -57,7 +67,8 @@ def setup_logger(log_type="console_file", log_file="logs/api.log", console_level
         logger.add(sys.stdout, level=console_level, format=log_format, backtrace=True, diagnose=True,
                    filter=lambda record: console_level_no <= record["level"].no != file_level_no)
     if log_type in ("file", "console_file"):
-        logger.add(log_file, encoding="utf-8", level=file_level, format=log_format, backtrace=True, diagnose=True,
+        # enqueue=True：写文件放到后台线程，调用方只做入队
+        logger.add(log_file, encoding="utf-8", level=file_level, format=log_format, backtrace=True, diagnose=True, enqueue=enqueue,
                    filter=lambda record: file_level_no <= record["level"].no != console_level_no)
     # else:
     #     logger.add(sys.stdout, level=console_level, format=log_format, backtrace=True, diagnose=True,
@@ -75,6 +86,67 @@ def setup_logger(log_type="console_file", log_file="logs/api.log", console_level
 def get_logger():
     return logger
 
+
+def sample_payload():
+    """在请求开始时按采样率决定本次请求是否记录载荷，同一请求内的后续载荷日志沿用该结果"""
+    rate = payload_config["sample_rate"]
+    sampled = rate >= 1 or (rate > 0 and random.random() < rate)
+    _payload_sampled.set(sampled)
+    return sampled
+
+
+def payload_sampled():
+    sampled = _payload_sampled.get()
+    return sample_payload() if sampled is None else sampled
+
+
+def truncate(text, max_chars=None):
+    """超长文本只保留头尾"""
+    text = str(text)
+    max_chars = max_chars or payload_config["max_chars"]
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n...(省略{len(text) - half * 2}字符)...\n{text[-half:]}"
+
+
+class PayloadRecorder:
+    """有界的响应原文记录：只保留头尾各约max_chars/2字符，未被采样时不做任何拼接"""
+
+    def __init__(self, title="", sampled=None, max_chars=None):
+        self.title = title
+        self.sampled = payload_sampled() if sampled is None else sampled
+        self.half = (max_chars or payload_config["max_chars"]) // 2
+        self.total = 0
+        self._head = []
+        self._head_chars = 0
+        self._tail = deque()
+        self._tail_chars = 0
+
+    def record(self, text):
+        if not self.sampled:
+            return
+        self.total += len(text) + 1
+        if self._head_chars < self.half:
+            self._head.append(text)
+            self._head_chars += len(text) + 1
+            return
+        self._tail.append(text)
+        self._tail_chars += len(text) + 1
+        while len(self._tail) > 1 and self._tail_chars - len(self._tail[0]) - 1 >= self.half:
+            self._tail_chars -= len(self._tail.popleft()) + 1
+
+    def render(self):
+        omitted = self.total - self._head_chars - self._tail_chars
+        parts = [f"{self.title}..."] + self._head
+        if omitted > 0:
+            parts.append(f"...(省略{omitted}字符)...")
+        parts.extend(self._tail)
+        return "\n".join(parts)
+
+    def __str__(self):
+        return self.render()
+
 def rename_file(ori_path='logs/api.log'):
     new_path = ori_path
     # 检查文件是否存在
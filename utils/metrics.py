@@ -0,0 +1,165 @@
+import bisect
+
+# 默认分桶（秒），覆盖亚毫秒到数十秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """固定分桶直方图，observe为O(log n)且不保存原始样本，可常驻生产环境"""
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf 桶
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """按分桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class MetricFamily:
+    """同名指标按标签值区分子指标；无标签时可直接调用子指标的方法"""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.children = {}  # 标签值 -> Histogram/Counter
+        self.callbacks = []  # 抓取时调用，返回数值或 {标签值: 数值}，用于读取组件已有的状态和计数
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = Histogram(self.name, self.buckets) if self.kind == "histogram" else Counter(self.name)
+            self.children[values] = child
+        return child
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        name = self.name + "_total" if self.kind == "counter" else self.name
+        for callback in self.callbacks:
+            try:
+                value = callback()
+            except Exception:
+                continue  # 单个采集失败不影响其他指标
+            if isinstance(value, dict):
+                yield from ((name, labels if isinstance(labels, tuple) else (labels,), sample) for labels, sample in value.items())
+            else:
+                yield name, (), value
+        for values, child in self.children.items():
+            if self.kind == "counter":
+                yield self.name + "_total", values, child.value
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield self.name + "_bucket", values + (("+Inf" if bound == float("inf") else repr(bound)),), cumulative
+            yield self.name + "_sum", values, child.sum
+            yield self.name + "_count", values, child.count
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        labelnames = self.labelnames
+        for name, values, value in self.samples():
+            names = labelnames + ("le",) if name.endswith("_bucket") else labelnames
+            if values:
+                labels = ",".join(f'{label}="{_escape(str(item))}"' for label, item in zip(names, values))
+                lines.append(f"{name}{{{labels}}} {_format(value)}")
+            else:
+                lines.append(f"{name} {_format(value)}")
+
+
+class Registry:
+    """进程内指标注册表：热路径只做计数和分桶累加，gauge在抓取时通过回调读取，渲染为Prometheus文本格式"""
+
+    def __init__(self):
+        self.families = {}
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._family("histogram", name, documentation, labelnames, buckets)
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        family = self._family("counter", name, documentation, labelnames)
+        if callback is not None:
+            family.callbacks.append(callback)
+        return family
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        family = self._family("gauge", name, documentation, labelnames)
+        family.callbacks.append(callback)
+        return family
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+    def _family(self, kind, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = MetricFamily(kind, name, documentation, labelnames, tuple(sorted(buckets)))
+        return family
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def pool_state(client):
+    """httpx连接池状态（读取httpcore内部结构，不同版本取不到时返回空）"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    idle = sum(1 for connection in connections if connection.is_idle())
+    queued = sum(1 for request in getattr(pool, "_requests", ()) if request.is_queued())
+    return {"connections": len(connections), "idle": idle, "active": len(connections) - idle, "queued": queued}
+
+
+registry = Registry()
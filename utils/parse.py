@@ -1,9 +1,16 @@
+import asyncio
 import json
+import os
+import time
 import xml.etree.ElementTree as ET
 from typing import Type
 
 from pydantic import BaseModel
 
+from utils.logger import get_logger
+
+logger = get_logger()
+
 
 def parse_xml(xml):
     """解析微信服务器发来的xml消息"""
@@ -35,3 +42,69 @@ def parse_config_to_model(model_class: Type[BaseModel], filepath: str) -> BaseMo
     model_config = model_class(**config_dict)
     return model_config
 
+
+
+class ConfigCache:
+    """解析后的配置缓存：按文件mtime热加载，解析成功后整体替换快照（快照只读），解析失败保留旧快照"""
+
+    def __init__(self, model_class: Type[BaseModel], filepath: str, check_interval=1.0):
+        self.model_class = model_class
+        self.filepath = filepath
+        self.check_interval = check_interval  # 两次检查mtime的最小间隔
+        self.version = 0
+        self._snapshot = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._watching = False
+        self._listeners = []
+
+    def get(self) -> BaseModel:
+        """返回当前快照；没有后台监听时按间隔检查文件变更"""
+        if self._snapshot is None or (not self._watching and time.monotonic() - self._checked_at >= self.check_interval):
+            self.reload_if_changed()
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """注册配置变更回调 callback(new_config)"""
+        self._listeners.append(callback)
+
+    def reload_if_changed(self) -> bool:
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.filepath).st_mtime_ns
+        except OSError as err:
+            if self._snapshot is None:
+                raise
+            logger.error(f"读取配置文件状态失败，继续使用旧配置: {err}")
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            snapshot = parse_config_to_model(self.model_class, self.filepath)
+        except Exception as err:
+            if self._snapshot is None:
+                raise
+            self._mtime = mtime  # 文件修复前不再重复解析
+            logger.error(f"配置文件解析失败，继续使用旧配置: {err}")
+            return False
+        reloaded = self._snapshot is not None
+        self._snapshot, self._mtime = snapshot, mtime
+        self.version += 1
+        if reloaded:
+            logger.info(f"配置文件已重新加载: {self.filepath}, version={self.version}")
+            for callback in self._listeners:
+                try:
+                    callback(snapshot)
+                except Exception as err:
+                    logger.error(f"应用新配置失败: {callback}, err: {err}")
+        return reloaded
+
+    async def watch(self):
+        """后台按间隔检查配置文件，期间get()不再做文件检查"""
+        self._watching = True
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval)
+                self.reload_if_changed()
+        finally:
+            self._watching = False
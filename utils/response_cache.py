@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class _Flight:
+    """一次进行中的流式请求：上游流在_Flight自己的任务中运行，相同key的并发请求都作为订阅方读取；
+    单个订阅方离开（被取消或中断）只影响自己，最后一个订阅方离开时才取消上游"""
+
+    def __init__(self, on_abandoned):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._on_abandoned = on_abandoned
+        self._changed = asyncio.Event()
+
+    def start(self, factory, on_complete):
+        self.task = asyncio.ensure_future(self._run(factory, on_complete))
+
+    async def _run(self, factory, on_complete):
+        stream = factory()
+        try:
+            async for content in stream:
+                self.chunks.append(content)
+                self._notify()
+        except asyncio.CancelledError:
+            self._finish(None)  # 只在没有订阅方时被取消，无需通知错误
+            raise
+        except Exception as exc:
+            self._finish(exc)  # 异常由各订阅方重新抛出，任务本身正常结束
+        else:
+            self._finish(None)
+            on_complete("".join(self.chunks))
+        finally:
+            await stream.aclose()
+
+    def _finish(self, error):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self._on_abandoned(self)
+                self.task.cancel()
+
+
+class ResponseCache:
+    """LLM应答缓存：按模型+归一化问题+inputs（及messages）生成key，内存LRU（条数/字节数上限）+ 可选SQLite二级缓存，
+    相同问题的并发请求共享一次调用，命中的答案可按流式接口回放"""
+
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024, db_path=None, replay_chunk_chars=20, purge_interval=1000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.replay_chunk_chars = replay_chunk_chars  # 回放时每个分块的字数
+        self.purge_interval = purge_interval
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "shared": 0, "evictions": 0}
+        self._data = OrderedDict()  # key -> (answer, expire_at, size)
+        self._bytes = 0
+        self._inflight = {}  # key -> Task，非流式请求
+        self._flights = {}  # key -> _Flight，流式请求
+        self._inserts = 0
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def metrics(self):
+        requests = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["hits"] + self.stats["disk_hits"]
+        return {**self.stats, "size": len(self._data), "bytes": self._bytes, "inflight": len(self._inflight) + len(self._flights),
+                "hit_rate": round(hits / requests, 4) if requests else 0.0}
+
+    @staticmethod
+    def normalize_query(query):
+        """合并空白、忽略大小写和句末标点"""
+        return " ".join((query or "").split()).lower().rstrip("?？。.!！~～ ")
+
+    @classmethod
+    def make_key(cls, params):
+        raw = json.dumps({"model": params.get("model"), "query": cls.normalize_query(params.get("query")),
+                          "inputs": params.get("inputs") or {}, "messages": params.get("messages") or []},
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取未过期的答案，内存未命中时查询SQLite并回填内存"""
+        now = time.time()
+        item = self._data.get(key)
+        if item is not None:
+            if item[1] > now:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return item[0]
+            self._pop(key)
+        if self._db is not None:
+            row = self._db.execute("SELECT answer, expire_at FROM response_cache WHERE key = ? AND expire_at > ?", (key, now)).fetchone()
+            if row is not None:
+                self._put(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, answer, ttl):
+        if not answer or ttl <= 0:
+            return
+        expire_at = time.time() + ttl
+        self._put(key, answer, expire_at)
+        if self._db is not None:
+            self._persist(key, answer, expire_at)
+
+    async def get_or_load(self, key, loader, ttl):
+        """非流式：命中直接返回，否则相同key只发起一次loader()调用"""
+        answer = self.get(key)
+        if answer is not None:
+            return answer
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+        else:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_loaded(key, ttl, t))
+        return await asyncio.shield(task)
+
+    async def stream(self, key, factory, ttl):
+        """流式：命中时按分块回放；未命中时在后台任务中调用一次factory()，并发的相同请求都订阅其输出"""
+        answer = self.get(key)
+        if answer is not None:
+            for start in range(0, len(answer), self.replay_chunk_chars):
+                yield answer[start:start + self.replay_chunk_chars]
+            return
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["shared"] += 1
+        else:
+            flight = self._flights[key] = _Flight(lambda abandoned: self._drop_flight(key, abandoned))
+            flight.start(factory, lambda answer: self.set(key, answer, ttl))
+            flight.task.add_done_callback(lambda _: self._drop_flight(key, flight))
+        follower = flight.follow()
+        try:
+            async for content in follower:
+                yield content
+        finally:
+            await follower.aclose()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _drop_flight(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _on_loaded(self, key, ttl, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result(), ttl)
+
+    def _put(self, key, answer, expire_at):
+        self._pop(key)
+        size = len(answer.encode('utf-8')) + len(key)
+        self._data[key] = (answer, expire_at, size)
+        self._bytes += size
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.stats["evictions"] += 1
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def _open_db(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expire_at REAL NOT NULL)")
+        self._db.execute("DELETE FROM response_cache WHERE expire_at <= ?", (time.time(),))
+
+    def _persist(self, key, answer, expire_at):
+        try:
+            self._db.execute("INSERT OR REPLACE INTO response_cache (key, answer, expire_at) VALUES (?, ?, ?)", (key, answer, expire_at))
+            self._inserts += 1
+            if self._inserts % self.purge_interval == 0:
+                self._db.execute("DELETE FROM response_cache WHERE expire_at <= ?", (time.time(),))
+        except sqlite3.Error as err:
+            logger.warning(f"应答缓存持久化失败: {err}")
@@ -0,0 +1,77 @@
+import asyncio
+import tempfile
+
+
+class ByteBudget:
+    """按字节数限制并发任务的异步预算，超过总预算的单个任务会独占全部预算"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, size):
+        size = min(size, self.capacity)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_use + size <= self.capacity)
+            self.in_use += size
+        return size
+
+    async def resize(self, held, size):
+        """把已占用的held字节调整为size，等待期间先让出已占用部分，避免多个任务互相持有等待"""
+        size = min(size, self.capacity)
+        async with self._cond:
+            self.in_use -= min(held, self.capacity)
+            self._cond.notify_all()
+            try:
+                await self._cond.wait_for(lambda: self.in_use + size <= self.capacity)
+            except BaseException:
+                self.in_use += min(held, self.capacity)
+                raise
+            self.in_use += size
+        return size
+
+    async def release(self, size):
+        async with self._cond:
+            self.in_use -= min(size, self.capacity)
+            self._cond.notify_all()
+
+
+class SpoolReader:
+    """只暴露read/seek/tell，避免httpx探测文件长度时调用fileno()使SpooledTemporaryFile提前落盘"""
+
+    def __init__(self, file):
+        self._file = file
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+
+async def spool_response(response, max_size=8 * 1024 * 1024, chunk_size=64 * 1024, byte_budget=None, reserved=0):
+    """
+    把httpx流式响应分块写入SpooledTemporaryFile，超过max_size后自动落盘
+    传入byte_budget时按实际写入字节数核对预占额度，超出后成倍追加，返回 (spool, reserved)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    held = reserved
+    try:
+        written = 0
+        async for chunk in response.aiter_bytes(chunk_size):
+            written += len(chunk)
+            if byte_budget is not None and held < written and held < byte_budget.capacity:
+                held = await byte_budget.resize(held, max(written, held * 2))
+            spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        # 追加的额度在这里归还，调用方只负责最初预占的部分
+        if held > reserved:
+            await byte_budget.release(held - reserved)
+        raise
+    return spool, held
@@ -0,0 +1,86 @@
+import json
+from collections import deque
+from typing import NamedTuple, Optional
+
+try:
+    import orjson  # 可选依赖，安装后用于加速事件JSON解析
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: str
+    retry: Optional[int]
+
+
+class SSEDecoder:
+    """增量SSE解码器：直接处理字节分块，按规范解析event/data/id/retry字段和注释行，
+    多行data以换行拼接，只在环形缓冲中保留最近capture个事件用于诊断"""
+
+    def __init__(self, capture=20):
+        self.last_event_id = ''
+        self.retry = None
+        self.recent = deque(maxlen=capture)
+        self._buffer = b''
+        self._event = ''
+        self._data = []
+
+    def feed(self, chunk: bytes) -> list:
+        """输入一个字节分块，返回其中已完整的事件"""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        if b'\r' in buffer:
+            if buffer.endswith(b'\r'):  # \r\n可能被分块截断，等待下一块
+                self._buffer = buffer
+                return []
+            buffer = buffer.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        lines = buffer.split(b'\n')
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            self._process_line(line, events)
+        return events
+
+    def close(self) -> list:
+        """流结束：处理剩余的不完整行，并宽松地派发未以空行结尾的事件"""
+        events = []
+        if self._buffer:
+            buffer, self._buffer = self._buffer, b''
+            for line in buffer.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n'):
+                self._process_line(line, events)
+        self._dispatch(events)
+        return events
+
+    def render(self):
+        return "\n".join(f"event: {event.event}\ndata: {event.data}" for event in self.recent)
+
+    def _process_line(self, line, events):
+        if not line:
+            self._dispatch(events)
+            return
+        if line[0] == 58:  # ':' 开头为注释（常用作心跳）
+            return
+        field, _, value = line.partition(b':')
+        if value[:1] == b' ':
+            value = value[1:]
+        if field == b'data':
+            self._data.append(value.decode('utf-8'))
+        elif field == b'event':
+            self._event = value.decode('utf-8')
+        elif field == b'id':
+            if b'\0' not in value:
+                self.last_event_id = value.decode('utf-8')
+        elif field == b'retry':
+            if value.isdigit():
+                self.retry = int(value)
+
+    def _dispatch(self, events):
+        if self._data:
+            event = SSEEvent(self._event or 'message', '\n'.join(self._data), self.last_event_id, self.retry)
+            events.append(event)
+            self.recent.append(event)
+        self._event = ''
+        self._data = []
@@ -1,9 +1,10 @@
 import asyncio
+import json
+import os
 import signal
 import sys
 import time
 
-import GPUtil
 import psutil
 
 from models.exception_model import SigIntException, SigTermException, ShutdownSignalException
@@ -12,21 +13,134 @@ from utils.loop import get_loop
 
 logger = get_logger()
 
-def get_system_status():
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory_info = psutil.virtual_memory()
-    memory_total = f"{memory_info.total / (1024 ** 3):.2f} GB"
-    memory_available = f"{memory_info.available / (1024 ** 3):.2f} GB"
-    memory_used = f"{memory_info.used / (1024 ** 3):.2f} GB"
-    memory_percent = memory_info.percent
-    gpuInfo = []
-    devices = ["cpu", "cuda:0"]
-    gpus = GPUtil.getGPUs()
-    for gpu in gpus:
-        gpuInfo.append(
+
+class SystemSampler:
+    """后台系统状态采样：按固定周期把CPU、内存、事件循环延迟和进程信息刷新到共享快照，读取时不做任何采样；
+    GPU探测需启动nvidia-smi子进程，只在有人查看时按较长周期在线程中进行"""
+
+    def __init__(self, interval=1.0, gpu=True, gpu_interval=10.0, gpu_idle=60.0):
+        self.interval = interval
+        self.gpu = gpu
+        self.gpu_interval = gpu_interval
+        self.gpu_idle = gpu_idle
+        self.snapshot = {}
+        self.payload = "{}"  # 快照的JSON，每个周期序列化一次，供各个读取方共享
+        self._process = psutil.Process()
+        self._gpus = []
+        self._gpu_available = True  # 探测失败或没有GPU时置为False，之后不再探测
+        self._gpu_probed_at = 0.0
+        self._gpu_task = None
+        self._read_at = 0.0
+        self._updated = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def reconfigure(self, interval, gpu, gpu_interval, gpu_idle):
+        self.interval = interval
+        self.gpu = gpu
+        self.gpu_interval = gpu_interval
+        self.gpu_idle = gpu_idle
+
+    def start(self, loop=None):
+        if self.running:
+            return
+        loop = loop or asyncio.get_running_loop()
+        # 首次调用只建立基线，之后每次返回距上次调用的平均使用率，不阻塞
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+        self._updated = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def close(self):
+        for task in (self._task, self._gpu_task):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    def read(self):
+        """返回最新快照的JSON，O(1)"""
+        self._read_at = time.monotonic()
+        return self.payload
+
+    async def updates(self):
+        """每次快照刷新后产出其JSON，供SSE推送"""
+        while True:
+            updated = self._updated  # 先取事件再读取，读取后发生的刷新不会错过
+            yield self.read()
+            await updated.wait()
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            try:
+                self._refresh(lag)
+            except Exception as exc:
+                logger.warning(f"系统状态采样失败: {type(exc).__name__}: {exc}")
+            self._probe_gpu()
+
+    def _refresh(self, lag):
+        memory_info = psutil.virtual_memory()
+        process = self._process
+        with process.oneshot():
+            process_info = {
+                "pid": process.pid,
+                "cpu_percent": process.cpu_percent(interval=None),
+                "rss": f"{process.memory_info().rss / (1024 ** 2):.1f} MB",
+                "threads": process.num_threads(),
+                "fds": process.num_fds() if hasattr(process, "num_fds") else None,
+                "tasks": len(asyncio.all_tasks()),
+            }
+        self.snapshot = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "cpu_count": os.cpu_count(),
+            "load_avg": [round(load, 2) for load in os.getloadavg()] if hasattr(os, "getloadavg") else None,
+            "memory_total": f"{memory_info.total / (1024 ** 3):.2f} GB",
+            "memory_available": f"{memory_info.available / (1024 ** 3):.2f} GB",
+            "memory_used": f"{memory_info.used / (1024 ** 3):.2f} GB",
+            "memory_percent": memory_info.percent,
+            "loop_lag_ms": round(lag * 1000, 2),
+            "process": process_info,
+            "gpu": self._gpus,
+            "sampled_at": time.time(),
+        }
+        self.payload = json.dumps(self.snapshot, ensure_ascii=False)
+        # 唤醒所有等待推送的订阅方，之后的订阅方等待新的事件
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def _probe_gpu(self):
+        now = time.monotonic()
+        if not (self.gpu and self._gpu_available) or now - self._read_at > self.gpu_idle or now - self._gpu_probed_at < self.gpu_interval:
+            return
+        if self._gpu_task is not None and not self._gpu_task.done():
+            return
+        self._gpu_probed_at = now
+        self._gpu_task = asyncio.get_running_loop().create_task(self._probe_gpu_async())
+
+    async def _probe_gpu_async(self):
+        try:
+            self._gpus = await asyncio.to_thread(self._get_gpus)
+        except Exception as exc:
+            self._gpu_available = False
+            logger.info(f"GPU探测不可用，已关闭: {type(exc).__name__}: {exc}")
+            return
+        if not self._gpus:
+            self._gpu_available = False
+            logger.info("未检测到GPU，已关闭GPU探测")
+
+    @staticmethod
+    def _get_gpus():
+        import GPUtil  # 可选依赖，需要时才导入
+
+        return [
             {
                 "gpu_id": gpu.id,
-                "gpu_load": f"{gpu.load}%",
+                "gpu_load": f"{gpu.load * 100:.0f}%",
                 "gpu_memory": {
                     "total_MB": f"{gpu.memoryTotal} MiB",
                     "total_GB": f"{gpu.memoryTotal / 1024:.2f} GiB",
@@ -34,17 +148,16 @@ def get_system_status():
                     "free": f"{gpu.memoryFree} MiB"
                 }
             }
-        )
-    status_data = {
-        "devices": devices,
-        "cpu_percent": cpu_percent,
-        "memory_total": memory_total,
-        "memory_available": memory_available,
-        "memory_used": memory_used,
-        "memory_percent": memory_percent,
-        "gpu": gpuInfo,
-    }
-    return status_data
+            for gpu in GPUtil.getGPUs()
+        ]
+
+
+system_sampler = SystemSampler()
+
+
+def get_system_status():
+    """最新的系统状态快照（由后台采样刷新，不阻塞）"""
+    return system_sampler.snapshot
 
 def keep_alive():
     while True:
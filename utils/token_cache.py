@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class TokenCache:
+    """访问令牌缓存：缓存至过期前，提前在后台刷新，并发调用方共享同一次刷新。
+    fetch为协程函数，返回(token, 有效期秒数)"""
+
+    def __init__(self, fetch, name="access_token", refresh_ahead=600, min_valid=30):
+        self.fetch = fetch
+        self.name = name
+        self.refresh_ahead = refresh_ahead  # 距过期多少秒开始后台刷新
+        self.min_valid = min_valid  # 剩余有效期低于该值时必须同步等待刷新
+        self.fetch_count = 0
+        self._token = None
+        self._expire_at = 0.0
+        self._refresh_task = None
+
+    async def get(self) -> str:
+        remaining = self._expire_at - time.monotonic()
+        if self._token and remaining > self.refresh_ahead:
+            return self._token
+        refresh_task = self._refresh()
+        if self._token and remaining > self.min_valid:
+            return self._token  # 仍然有效，刷新在后台进行
+        return await asyncio.shield(refresh_task)
+
+    def invalidate(self):
+        """token被服务端判定失效时调用，下次获取将强制刷新"""
+        self._token = None
+        self._expire_at = 0.0
+
+    def _refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._fetch())
+            self._refresh_task.add_done_callback(self._on_refreshed)
+        return self._refresh_task
+
+    async def _fetch(self) -> str:
+        token, expires_in = await self.fetch()
+        self.fetch_count += 1
+        self._token = token
+        self._expire_at = time.monotonic() + expires_in
+        logger.info(f"{self.name}已刷新, 有效期{expires_in}秒, 累计获取{self.fetch_count}次")
+        return token
+
+    def _on_refreshed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"刷新{self.name}异常: {task.exception()}")